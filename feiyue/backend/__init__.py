@@ -1,31 +1,150 @@
+import collections
 import re
 from pathlib import Path
 from . import api
 from collections.abc import Generator
-import requests
-
+from concurrent.futures import ThreadPoolExecutor
 
+_tables = ["本科专业", "申请人", "项目", "数据点"]
 _image_url_pattern = re.compile(r"https://.+?(/images/auto-upload/(.+?\.[a-z|A-Z]+))")
 
 
-def get_all_rows(api_key: str) -> tuple[dict, dict, dict, dict]:
-    api.init_base_token(api_key)
-    all_majors = api.get_all_rows("本科专业")
-    all_applicants = api.get_all_rows("申请人")
-    all_programs = api.get_all_rows("项目")
-    all_datapoints = api.get_all_rows("数据点")
+def get_all_rows(
+    client: api.SeaTableClient, workers: int = 1, page_size: int = api.BATCH_SIZE
+) -> tuple[dict, dict, dict, dict]:
+    with client.profiler.stage("token"):
+        client.init_base_token()
+
+    def _get_table(table: str, executor: ThreadPoolExecutor = None) -> dict:
+        with client.profiler.stage(f"fetch {table}") as stage:
+            rows = client.get_all_rows(table, page_size, executor, workers)
+            stage["items"] = len(rows)
+        return rows
+
+    if workers > 1:
+        # tables are fetched in parallel, sharing one pool for page requests
+        with ThreadPoolExecutor(workers) as page_executor, ThreadPoolExecutor(
+            len(_tables)
+        ) as table_executor:
+            futures = [
+                table_executor.submit(_get_table, table, page_executor)
+                for table in _tables
+            ]
+            all_majors, all_applicants, all_programs, all_datapoints = [
+                future.result() for future in futures
+            ]
+    else:
+        all_majors, all_applicants, all_programs, all_datapoints = [
+            _get_table(table) for table in _tables
+        ]
+
     _rebuild_relations(all_applicants, all_datapoints, all_programs)
 
     return all_applicants, all_datapoints, all_programs, all_majors
 
 
+def sync_all_rows(
+    client: api.SeaTableClient,
+    cached_rows: dict[str, dict],
+    watermarks: dict[str, str],
+    workers: int = 1,
+    page_size: int = api.BATCH_SIZE,
+) -> tuple[dict[str, dict], dict[str, str], dict[str, tuple[int, int]]]:
+    """
+    Bring cached rows up to date, fetching only rows modified since the last sync.
+
+    `cached_rows` and `watermarks` are keyed by table name; a table without a
+    cached copy or a watermark is fetched in full. Returns the updated rows and
+    watermarks, and the number of (fetched, deleted) rows of each table.
+    """
+    with client.profiler.stage("token"):
+        client.init_base_token()
+
+    def _sync_table(table: str):
+        with client.profiler.stage(f"sync {table}") as stage:
+            result = _sync_rows(table)
+            stage["items"] = result[2][0]
+        return result
+
+    def _sync_rows(table: str):
+        rows = cached_rows.get(table)
+        since = watermarks.get(table)
+        if rows is None or since is None:
+            rows = client.get_all_rows(table, page_size)
+            return rows, _max_mtime(rows.values(), None), (len(rows), 0)
+
+        # rows modified at the watermark itself are fetched again, so that
+        # changes made within the same timestamp are not missed
+        since = since.replace("'", "''")
+        # queries are paged, and only a total order keeps pages from
+        # overlapping or skipping rows
+        changed = client.query(
+            f"SELECT * FROM `{table}` WHERE `_mtime` >= '{since}' ORDER BY `_id`"
+        )
+        # deleted rows only show up as ids missing from the table
+        row_ids = {
+            row["_id"]
+            for row in client.query(f"SELECT `_id` FROM `{table}` ORDER BY `_id`")
+        }
+
+        # keep the order of the table, as a full fetch would: cached rows stay
+        # in place, and new rows are appended in the order they were created
+        synced = {id: row for id, row in rows.items() if id in row_ids}
+        deleted = len(rows) - len(synced)
+        for row in changed:
+            if row["_id"] in synced:
+                synced[row["_id"]] = row
+        new_rows = [row for row in changed if row["_id"] not in synced]
+        new_rows.sort(key=lambda row: (row.get("_ctime") or "", row["_id"]))
+        for row in new_rows:
+            if row["_id"] in row_ids:
+                synced[row["_id"]] = row
+
+        return (
+            synced,
+            _max_mtime(changed, watermarks[table]),
+            (len(changed), deleted),
+        )
+
+    if workers > 1:
+        with ThreadPoolExecutor(min(workers, len(_tables))) as executor:
+            results = list(executor.map(_sync_table, _tables))
+    else:
+        results = [_sync_table(table) for table in _tables]
+
+    synced_rows = {table: result[0] for table, result in zip(_tables, results)}
+    new_watermarks = {table: result[1] for table, result in zip(_tables, results)}
+    counts = {table: result[2] for table, result in zip(_tables, results)}
+
+    _rebuild_relations(
+        synced_rows["申请人"], synced_rows["数据点"], synced_rows["项目"]
+    )
+
+    return synced_rows, new_watermarks, counts
+
+
+def get_watermarks(rows: dict[str, dict]) -> dict[str, str]:
+    """
+    Get the latest modification time of each table, to sync from next time.
+    """
+    return {table: _max_mtime(rows[table].values(), None) for table in _tables}
+
+
+def _max_mtime(rows, default: str) -> str:
+    # SeaTable timestamps share one ISO format, so they compare as strings
+    return max((row["_mtime"] for row in rows if row.get("_mtime")), default=default)
+
+
 def _rebuild_relations(applicants: dict, datapoints: dict, programs: dict):
     # applicant -> datapoints
     for applicant in applicants.values():
         applicant["数据点"] = []
     for id, datapoint in datapoints.items():
         if len(datapoint.get("申请人", [])) > 0:
-            applicants[datapoint["申请人"][0]["row_id"]]["数据点"].append(id)
+            applicant_id = datapoint["申请人"][0]["row_id"]
+            # dangling links are dropped later by `filter_out_invalid`
+            if applicant_id in applicants:
+                applicants[applicant_id]["数据点"].append(id)
 
     # program -> datapoints
     for program in programs.values():
@@ -50,128 +169,153 @@ def term_value(year: int, term: str) -> float:
 
 def filter_out_invalid(
     applicants: dict, datapoints: dict, programs: dict, majors: dict
-):
-    has_invalid = True
+) -> list[dict]:
+    """
+    Drop invalid rows in place, and the rows that become invalid because rows
+    they depend on are dropped, until all remaining rows are valid.
+
+    Every row is checked once; after that, only the rows referencing a dropped
+    row are checked again. Links to dropped rows are removed from the remaining
+    rows. Returns the dropped rows with the reasons they were dropped.
+    """
+    tables = {
+        "申请人": applicants,
+        "数据点": datapoints,
+        "项目": programs,
+        "本科专业": majors,
+    }
+
+    def _existing(links: list, table: dict) -> list:
+        return [link for link in links if link["row_id"] in table]
 
     # dependency: applicant <-> datapoint <-> program
     #             applicant <-> major
-    def _applicant_valid(applicant: dict) -> bool:
-        global has_invalid
-        valid = (
-            "数据点" in applicant
-            and len(applicant["数据点"]) > 0
-            and "专业" in applicant
-            and len(applicant["专业"]) > 0
-        )
-        if not valid:
-            return False
-        has_chosen = False
-        for datapoint in applicant["数据点"]:
-            if datapoint not in datapoints:
-                has_invalid = True
-                applicant["数据点"].remove(datapoint)
-            else:
-                if datapoints[datapoint].get("最终去向"):
-                    has_chosen = True
-        if not has_chosen:
-            return False
+    def _applicant_invalid(applicant: dict) -> str:
+        if not applicant.get("专业"):
+            return "no major"
+        applicant["数据点"] = [
+            datapoint
+            for datapoint in applicant.get("数据点", [])
+            if datapoint in datapoints
+        ]
+        if len(applicant["数据点"]) == 0:
+            return "no datapoints"
+        if not any(
+            datapoints[datapoint].get("最终去向") for datapoint in applicant["数据点"]
+        ):
+            return "no final destination"
         if applicant["专业"][0]["row_id"] not in majors:
-            return False
-        return True
-
-    def _program_valid(program: dict) -> bool:
-        global has_invalid
-        valid = (
-            "项目" in program
-            and len(program["项目"]) > 0
-            and "学校" in program
-            and len(program["学校"]) > 0
-            and "数据点" in program
-            and len(program["数据点"]) > 0
+            return "major not found"
+        return None
+
+    def _datapoint_invalid(datapoint: dict) -> str:
+        if not datapoint.get("项目"):
+            return "no program"
+        if "学年" not in datapoint or not datapoint.get("学期"):
+            return "no term"
+        if not datapoint.get("申请人"):
+            return "no applicant"
+        datapoint["申请人"] = _existing(datapoint["申请人"], applicants)
+        if len(datapoint["申请人"]) == 0:
+            return "applicant not found"
+        if datapoint["项目"][0]["row_id"] not in programs:
+            return "program not found"
+        return None
+
+    def _major_invalid(major: dict) -> str:
+        if not major.get("院系") or not major.get("专业"):
+            return "no department or name"
+        if not major.get("申请人"):
+            return "no applicants"
+        major["申请人"] = _existing(major["申请人"], applicants)
+        if len(major["申请人"]) == 0:
+            return "applicants not found"
+        return None
+
+    def _program_invalid(program: dict) -> str:
+        if not program.get("项目") or not program.get("学校"):
+            return "no name or school"
+        program["数据点"] = [
+            datapoint
+            for datapoint in program.get("数据点", [])
+            if datapoint in datapoints
+        ]
+        if len(program["数据点"]) == 0:
+            return "no datapoints"
+        return None
+
+    checks = {
+        "申请人": _applicant_invalid,
+        "数据点": _datapoint_invalid,
+        "项目": _program_invalid,
+        "本科专业": _major_invalid,
+    }
+
+    # rows to check again when a row is dropped
+    dependents: dict[tuple[str, str], list[tuple[str, str]]] = {}
+
+    def _depends(row: tuple[str, str], table: str, ids):
+        for id in ids:
+            dependents.setdefault((table, id), []).append(row)
+
+    for id, applicant in applicants.items():
+        _depends(("申请人", id), "数据点", applicant.get("数据点", []))
+        _depends(
+            ("申请人", id),
+            "本科专业",
+            [link["row_id"] for link in (applicant.get("专业") or [])[:1]],
         )
-        if not valid:
-            return False
-        for datapoint in program["数据点"]:
-            if datapoint not in datapoints:
-                has_invalid = True
-                program["数据点"].remove(datapoint)
-        return True
-
-    def _datapoint_valid(datapoint: dict) -> bool:
-        global has_invalid
-        valid = (
-            "项目" in datapoint
-            and len(datapoint["项目"]) > 0
-            and "学年" in datapoint
-            and "学期" in datapoint
-            and len(datapoint["学期"]) > 0
-            and "申请人" in datapoint
-            and len(datapoint["申请人"]) > 0
+    for id, datapoint in datapoints.items():
+        _depends(
+            ("数据点", id),
+            "申请人",
+            [link["row_id"] for link in datapoint.get("申请人") or []],
         )
-        if not valid:
-            return False
-        for applicant in datapoint["申请人"]:
-            if applicant["row_id"] not in applicants:
-                has_invalid = True
-                datapoint["申请人"].remove(applicant)
-        if datapoint["项目"][0]["row_id"] not in programs:
-            return False
-        return True
-
-    def _major_valid(major: dict) -> bool:
-        global has_invalid
-        valid = (
-            "院系" in major
-            and len(major["院系"]) > 0
-            and "专业" in major
-            and len(major["专业"]) > 0
-            and "申请人" in major
-            and len(major["申请人"]) > 0
+        _depends(
+            ("数据点", id),
+            "项目",
+            [link["row_id"] for link in (datapoint.get("项目") or [])[:1]],
         )
-        if not valid:
-            return False
-        for applicant in major["申请人"]:
-            if applicant["row_id"] not in applicants:
-                has_invalid = True
-                major["申请人"].remove(applicant)
-        return True
-
-    while has_invalid:
-        has_invalid = False
-        applicant_invalid = []
-        program_invalid = []
-        datapoint_invalid = []
-        major_invalid = []
-
-        # applicant
-        for applicant in applicants.values():
-            if not _applicant_valid(applicant):
-                applicant_invalid.append(applicant["_id"])
-                has_invalid = True
-        for invalid_applicant in applicant_invalid:
-            applicants.pop(invalid_applicant)
-
-        for datapoint in datapoints.values():
-            if not _datapoint_valid(datapoint):
-                datapoint_invalid.append(datapoint["_id"])
-                has_invalid = True
-        for invalid_datapoint in datapoint_invalid:
-            datapoints.pop(invalid_datapoint)
-
-        for major in majors.values():
-            if not _major_valid(major):
-                major_invalid.append(major["_id"])
-                has_invalid = True
-        for invalid_major in major_invalid:
-            majors.pop(invalid_major)
-
-        # program
-        for program in programs.values():
-            if not _program_valid(program):
-                program_invalid.append(program["_id"])
-                has_invalid = True
-        for invalid_program in program_invalid:
-            programs.pop(invalid_program)
+    for id, major in majors.items():
+        _depends(
+            ("本科专业", id),
+            "申请人",
+            [link["row_id"] for link in major.get("申请人") or []],
+        )
+    for id, program in programs.items():
+        _depends(("项目", id), "数据点", program.get("数据点", []))
+
+    worklist = collections.deque(
+        (table, id) for table, rows in tables.items() for id in rows.keys()
+    )
+    queued = set(worklist)
+    dropped = []
+
+    while len(worklist) > 0:
+        row = worklist.popleft()
+        queued.remove(row)
+        table, id = row
+        if id not in tables[table]:
+            continue
+
+        reason = checks[table](tables[table][id])
+        if reason is None:
+            continue
+
+        dropped.append(
+            {
+                "table": table,
+                "_id": id,
+                "ID": tables[table].pop(id).get("ID"),
+                "reason": reason,
+            }
+        )
+        for dependent in dependents.get(row, []):
+            if dependent not in queued:
+                worklist.append(dependent)
+                queued.add(dependent)
+
+    return dropped
 
 
 def set_term(applicants: dict, datapoints: dict, key: str):
@@ -210,7 +354,3 @@ def update_image_path(applicants: dict, base_path: str) -> list[tuple[str, str]]
         applicant["申请总结"] = summary
 
     return ret
-
-
-def download_image(path: str, api_key: str) -> bytes:
-    return requests.get(api.get_image_direct_url(path, api_key)).content
@@ -1,80 +1,210 @@
+import collections
+from concurrent.futures import Executor
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-_api_key = None
-api_base = None
-base_token = None
-dtable_uuid = None
-
-
-def seatable_request(method: str, path: str, params: dict = None, data: dict = None):
-    # make request
-    response = requests.request(
-        method,
-        f"{api_base}/api-gateway/api/v2/dtables/{dtable_uuid}{path}",
-        params=params,
-        data=data,
-        headers={"Accept": "application/json", "Authorization": "Bearer " + base_token},
-    )
-
-    # check response
-    if response.status_code != 200:
-        raise Exception(
-            f"Request failed with status {response.status_code} and message {response.text}"
-        )
+from .. import profiler as profiling
+
+BATCH_SIZE = 100
+SQL_BATCH_SIZE = 10000
+DEFAULT_API_BASE = "https://cloud.seatable.io"
 
-    return response.json()
 
+class SeaTableClient:
+    """
+    Client for a single SeaTable base.
 
-def init_base_token(api_key: str):
-    global _api_key
-    _api_key = api_key
-    response = requests.request(
-        "GET",
-        f"{api_base}/api/v2.1/dtable/app-access-token/",
-        headers={"Accept": "application/json", "Authorization": "Bearer " + api_key},
-    )
+    All requests go through one pooled session, so connections are kept alive
+    between pages and images. Requests failing with a transient error (429 or
+    5xx, or a dropped connection) are retried with exponential backoff, and a
+    `Retry-After` header sent by the server is honored.
+    """
 
-    if response.status_code != 200:
-        raise Exception(
-            f"Request failed with status {response.status_code} and message {response.text}"
+    def __init__(
+        self,
+        api_key: str,
+        api_base: str = DEFAULT_API_BASE,
+        timeout: float = 30,
+        retries: int = 5,
+        backoff: float = 0.5,
+        pool_size: int = 10,
+        profiler: profiling.Profiler = profiling.disabled,
+    ):
+        self.api_key = api_key
+        self.profiler = profiler
+        self.api_base = api_base
+        self.timeout = timeout
+        self.base_token = None
+        self.dtable_uuid = None
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=[429, 500, 502, 503, 504],
+            # all requests we make are reads, including the POSTed SQL queries
+            allowed_methods=["GET", "POST"],
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
         )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method: str, url: str, token: str = None, **kwargs):
+        headers = {}
+        if token is not None:
+            headers = {"Accept": "application/json", "Authorization": "Bearer " + token}
+        response = self.session.request(
+            method, url, headers=headers, timeout=self.timeout, **kwargs
+        )
+
+        self.profiler.count("http requests")
+        if response.raw is not None and response.raw.retries is not None:
+            self.profiler.count("http retries", len(response.raw.retries.history))
+        if "Content-Length" in response.headers:
+            self.profiler.count(
+                "http bytes received", int(response.headers["Content-Length"])
+            )
+        elif not kwargs.get("stream"):
+            self.profiler.count("http bytes received", len(response.content))
+
+        # check response
+        if response.status_code != 200:
+            raise Exception(
+                f"Request failed with status {response.status_code} and message {response.text}"
+            )
+
+        return response
+
+    def seatable_request(
+        self,
+        method: str,
+        path: str,
+        params: dict = None,
+        data: dict = None,
+        json: dict = None,
+    ):
+        return self.request(
+            method,
+            f"{self.api_base}/api-gateway/api/v2/dtables/{self.dtable_uuid}{path}",
+            token=self.base_token,
+            params=params,
+            data=data,
+            json=json,
+        ).json()
 
-    response = response.json()
-    global base_token, dtable_uuid
-    base_token = response["access_token"]
-    dtable_uuid = response["dtable_uuid"]
+    def init_base_token(self):
+        response = self.request(
+            "GET",
+            f"{self.api_base}/api/v2.1/dtable/app-access-token/",
+            token=self.api_key,
+        ).json()
 
+        self.base_token = response["access_token"]
+        self.dtable_uuid = response["dtable_uuid"]
 
-def get_all_rows(table_name: str):
-    ret = {}
-    query_start = 0
-    BATCH_SIZE = 100
-    while True:
-        response = seatable_request(
+    def _get_rows_page(self, table_name: str, start: int, limit: int) -> list:
+        response = self.seatable_request(
             "GET",
             "/rows",
             {
                 "table_name": table_name,
-                "start": query_start,
-                "limit": BATCH_SIZE,
+                "start": start,
+                "limit": limit,
                 "convert_keys": True,
             },
         )
+        return response["rows"]
+
+    def get_all_rows(
+        self,
+        table_name: str,
+        page_size: int = BATCH_SIZE,
+        executor: Executor = None,
+        prefetch: int = 1,
+    ):
+        """
+        Get all rows of a table, keyed by row id.
+
+        Without an executor, pages are fetched one after another. With an
+        executor, up to `prefetch` pages are requested ahead of the one being
+        consumed; pages are still consumed in order, so the result is identical
+        in both cases.
+        """
+        ret = {}
+
+        if executor is None:
+            query_start = 0
+            while True:
+                rows = self._get_rows_page(table_name, query_start, page_size)
+                for row in rows:
+                    ret[row["_id"]] = row
+                if len(rows) < page_size:
+                    break
+                query_start += page_size
+
+            return ret
+
+        pending = collections.deque()
+        query_start = 0
 
-        for row in response["rows"]:
-            ret[row["_id"]] = row
-        if len(response["rows"]) < BATCH_SIZE:
-            break
-        query_start += BATCH_SIZE
+        def _request_next_page():
+            nonlocal query_start
+            pending.append(
+                executor.submit(self._get_rows_page, table_name, query_start, page_size)
+            )
+            query_start += page_size
 
-    return ret
+        for _ in range(max(prefetch, 1)):
+            _request_next_page()
 
+        while len(pending) > 0:
+            rows = pending.popleft().result()
+            for row in rows:
+                ret[row["_id"]] = row
+            if len(rows) < page_size:
+                # the table ends here, pages requested beyond it are empty
+                for future in pending:
+                    future.cancel()
+                break
+            _request_next_page()
 
-def get_image_direct_url(file_name: str, api_key: str) -> str:
-    response = requests.request(
-        "GET",
-        f"{api_base}/api/v2.1/dtable/app-download-link",
-        params={"path": f"{file_name}"},
-        headers={"Accept": "application/json", "Authorization": "Bearer " + api_key},
-    )
-    return response.json()["download_link"]
+        return ret
+
+    def query(self, sql: str, page_size: int = SQL_BATCH_SIZE) -> list:
+        """
+        Run a SQL query, paging through results with LIMIT/OFFSET. The query
+        must have a total ORDER BY (e.g. on `_id`), or pages may overlap or skip
+        rows.
+        """
+        ret = []
+        query_start = 0
+        while True:
+            response = self.seatable_request(
+                "POST",
+                "/sql",
+                json={
+                    "sql": f"{sql} LIMIT {page_size} OFFSET {query_start}",
+                    "convert_keys": True,
+                },
+            )
+            ret += response["results"]
+            if len(response["results"]) < page_size:
+                break
+            query_start += page_size
+
+        return ret
+
+    def get_image_direct_url(self, file_name: str) -> str:
+        response = self.request(
+            "GET",
+            f"{self.api_base}/api/v2.1/dtable/app-download-link",
+            token=self.api_key,
+            params={"path": f"{file_name}"},
+        )
+        return response.json()["download_link"]
@@ -0,0 +1,186 @@
+import json
+import zipfile
+from pathlib import Path
+
+from . import _rebuild_relations, _tables
+from .images import CHUNK_SIZE, ImageCache
+
+# columns whose values are the metadata of the rows, by column type
+_metadata_columns = {
+    "ctime": "_ctime",
+    "mtime": "_mtime",
+    "creator": "_creator",
+    "last-modifier": "_last_modifier",
+}
+# columns computed by SeaTable, which the API returns but an export may not hold
+_computed_columns = ("formula", "link-formula", "auto-number")
+# columns without values, not returned by the API either
+_valueless_columns = ("button",)
+
+
+class DtableArchive:
+    """
+    Reader of a `.dtable` base export (see `scripts/export.sh`), producing the
+    same rows as `get_all_rows` and the images of the base without any API call.
+
+    The export is a zip archive with the whole base in `content.json`, and the
+    assets of the base under their asset paths (e.g. `images/auto-upload/...`).
+    Members are read as streams from the archive, nothing is unpacked to disk
+    except the images requested.
+
+    In `content.json`, cells are keyed by column keys, select columns hold
+    option ids, and links are kept apart from the rows, in `links`. These are
+    converted to the shapes returned by the API with `convert_keys`.
+    Metadata columns (e.g. the modification time) are filled from the metadata
+    of the rows. Computed columns (e.g. formulas) are only kept by some exports:
+    an archive where no row holds the value of such a column is rejected, since
+    the column cannot be computed offline.
+    """
+
+    def __init__(self, path: Path):
+        self.archive = zipfile.ZipFile(path)
+
+    def close(self):
+        self.archive.close()
+
+    def get_all_rows(self) -> tuple[dict, dict, dict, dict]:
+        with self.archive.open("content.json") as f:
+            content = json.load(f)
+
+        tables = {table["_id"]: table for table in content["tables"]}
+        links = {link["_id"]: link for link in content.get("links", [])}
+        rows_by_name = {}
+        for table in tables.values():
+            if table["name"] in _tables:
+                _check_computed_columns(table)
+                rows_by_name[table["name"]] = {
+                    row["_id"]: _convert_row(row, table, tables, links)
+                    for row in table["rows"]
+                }
+
+        for table in _tables:
+            if table not in rows_by_name:
+                raise Exception(f"Table {table} not found in the archive")
+
+        all_majors, all_applicants, all_programs, all_datapoints = [
+            rows_by_name[table] for table in _tables
+        ]
+        _rebuild_relations(all_applicants, all_datapoints, all_programs)
+
+        return all_applicants, all_datapoints, all_programs, all_majors
+
+    def extract_images(
+        self, image_cache: ImageCache, paths: list[tuple[str, str]]
+    ) -> int:
+        """
+        Copy images in `paths` (pairs of file name and SeaTable path, as returned
+        by `update_image_path`) that are not cached yet from the archive into
+        `image_cache`. Returns the number of images copied; images missing from
+        the archive are skipped.
+        """
+        members = {}
+        for name in self.archive.namelist():
+            # asset paths may be nested under a directory of the base
+            for url_path in _suffixes(name):
+                members.setdefault(url_path, name)
+
+        extracted = 0
+        try:
+            for file_name, url_path in image_cache.get_missing(paths).items():
+                member = members.get(url_path.lstrip("/"))
+                if member is None:
+                    # the snapshot lacks the asset, retrying would not help
+                    print(f"Image {url_path} not found in the archive, skipped")
+                    continue
+                extracted += 1
+                with self.archive.open(member) as f:
+                    image_cache.store(
+                        file_name,
+                        iter(lambda: f.read(CHUNK_SIZE), b""),
+                        self.archive.getinfo(member).file_size,
+                    )
+        finally:
+            image_cache.save_manifest()
+
+        return extracted
+
+
+def _suffixes(name: str) -> list[str]:
+    parts = name.split("/")
+    return ["/".join(parts[i:]) for i in range(len(parts))]
+
+
+def _convert_row(row: dict, table: dict, tables: dict, links: dict) -> dict:
+    converted = {key: value for key, value in row.items() if key.startswith("_")}
+    for column in table["columns"]:
+        if column["type"] == "link":
+            value = _get_links(row["_id"], column, tables, links)
+            if len(value) == 0:
+                continue
+        elif column["type"] in _metadata_columns:
+            value = row.get(_metadata_columns[column["type"]])
+            if value is None:
+                continue
+        elif column["type"] in _valueless_columns or column["key"] not in row:
+            continue
+        else:
+            value = row[column["key"]]
+            if column["type"] in ("single-select", "multiple-select"):
+                options = {
+                    option["id"]: option["name"]
+                    for option in (column.get("data") or {}).get("options", [])
+                }
+                if column["type"] == "single-select":
+                    value = options.get(value, value)
+                elif isinstance(value, list):
+                    value = [options.get(option, option) for option in value]
+
+        converted[column["name"]] = value
+    return converted
+
+
+def _check_computed_columns(table: dict):
+    if len(table["rows"]) == 0:
+        return
+    for column in table["columns"]:
+        if column["type"] in _computed_columns and not any(
+            column["key"] in row for row in table["rows"]
+        ):
+            raise Exception(
+                f"Column {column['name']} of table {table['name']} is a "
+                f"{column['type']} column without values in the archive, "
+                "build from the API instead"
+            )
+
+
+def _get_links(row_id: str, column: dict, tables: dict, links: dict) -> list:
+    data = column["data"]
+    link = links.get(data["link_id"])
+    if link is None:
+        return []
+
+    if link["table1_id"] == data["table_id"]:
+        linked_ids = link.get("table1_table2_map", {}).get(row_id, [])
+    else:
+        linked_ids = link.get("table2_table1_map", {}).get(row_id, [])
+
+    other_table = tables[data["other_table_id"]]
+    # the display value is the display column of the link, by default the first
+    # column of the linked row
+    display_key = data.get("display_column_key") or other_table["columns"][0]["key"]
+    other_rows = _rows_by_id(other_table)
+    return [
+        {
+            "row_id": id,
+            "display_value": other_rows[id].get(display_key, ""),
+        }
+        for id in linked_ids
+        if id in other_rows
+    ]
+
+
+def _rows_by_id(table: dict) -> dict:
+    # built once per table, kept on the table of the parsed content
+    if "__rows_by_id" not in table:
+        table["__rows_by_id"] = {row["_id"]: row for row in table["rows"]}
+    return table["__rows_by_id"]
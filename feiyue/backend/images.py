@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .api import SeaTableClient
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ImageCache:
+    """
+    Directory of images downloaded from SeaTable, with a manifest of their sizes
+    and SHA-256 digests.
+
+    Images are streamed into a temporary file and renamed into place only when
+    complete, then recorded in the manifest. A file missing from the manifest,
+    or whose size or digest does not match it, is downloaded again.
+    """
+
+    def __init__(self, image_dir: Path, manifest_path: Path):
+        self.image_dir = image_dir
+        self.manifest_path = manifest_path
+        self._lock = threading.Lock()
+
+        try:
+            with open(manifest_path, "r") as f:
+                self.manifest: dict = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def is_valid(self, file_name: str) -> bool:
+        entry = self.manifest.get(file_name)
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(self.image_dir / file_name)
+        except OSError:
+            return False
+        if stat.st_size != entry["size"]:
+            return False
+        # only rehash files touched since they were downloaded
+        if stat.st_mtime_ns != entry["mtime"]:
+            if _file_digest(self.image_dir / file_name) != entry["sha256"]:
+                return False
+            entry["mtime"] = stat.st_mtime_ns
+        return True
+
+    def get_missing(self, paths: list[tuple[str, str]]) -> dict[str, str]:
+        """
+        Return the images in `paths` (pairs of file name and SeaTable path) that
+        are not cached yet, as a mapping from file name to SeaTable path.
+        """
+        self.image_dir.mkdir(parents=True, exist_ok=True)
+        return {
+            file_name: url_path
+            for file_name, url_path in paths
+            if not self.is_valid(file_name)
+        }
+
+    def download_all(
+        self, client: SeaTableClient, paths: list[tuple[str, str]], workers: int = 1
+    ) -> int:
+        """
+        Download images in `paths` (pairs of file name and SeaTable path) that
+        are not cached yet. Returns the number of images downloaded.
+        """
+        missing = self.get_missing(paths)
+
+        try:
+            if workers > 1:
+                with ThreadPoolExecutor(workers) as executor:
+                    futures = [
+                        executor.submit(self._download, client, *item)
+                        for item in missing.items()
+                    ]
+                    for future in futures:
+                        future.result()
+            else:
+                for item in missing.items():
+                    self._download(client, *item)
+        finally:
+            # keep what was downloaded even if some image failed
+            self.save_manifest()
+
+        return len(missing)
+
+    def _download(self, client: SeaTableClient, file_name: str, url_path: str):
+        url = client.get_image_direct_url(url_path)
+        with client.request("GET", url, stream=True) as response:
+            expected_size = response.headers.get("Content-Length")
+            if "Content-Encoding" in response.headers:
+                # the length is of the encoded body
+                expected_size = None
+            self.store(
+                file_name,
+                response.iter_content(CHUNK_SIZE),
+                int(expected_size) if expected_size is not None else None,
+            )
+
+    def store(self, file_name: str, chunks: Iterable[bytes], expected_size: int = None):
+        """
+        Store an image from `chunks` of its content, replacing the cached file
+        only if all of it (`expected_size` bytes, if given) was received.
+        """
+        digest = hashlib.sha256()
+        size = 0
+
+        fd, temp_path = tempfile.mkstemp(dir=self.image_dir, prefix=".", suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            if expected_size is not None and expected_size != size:
+                raise Exception(
+                    f"Image {file_name} truncated: got {size} of {expected_size} bytes"
+                )
+            os.replace(temp_path, self.image_dir / file_name)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        with self._lock:
+            self.manifest[file_name] = {
+                "size": size,
+                "sha256": digest.hexdigest(),
+                "mtime": os.stat(self.image_dir / file_name).st_mtime_ns,
+            }
+
+    def save_manifest(self):
+        with self._lock:
+            with open(self.manifest_path, "w") as f:
+                json.dump(self.manifest, f, ensure_ascii=False)
+
+
+def _file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,161 @@
+import sys
+
+
+def _intern(value):
+    # enum-like columns take few distinct values, share one string for each
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _number(value) -> float:
+    # scores are entered by hand, and may be text
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Major:
+    __slots__ = ("id", "code", "department", "name", "applicants")
+
+    def __init__(self, row: dict):
+        self.id: str = row["_id"]
+        self.code: str = row["ID"]
+        self.department: str = _intern(row.get("院系"))
+        self.name: str = row.get("专业")
+        self.applicants: list[Applicant] = []
+
+
+class Program:
+    __slots__ = ("id", "code", "school", "name", "category", "datapoints")
+
+    def __init__(self, row: dict):
+        self.id: str = row["_id"]
+        self.code: str = row["ID"]
+        self.school: str = _intern(row.get("学校"))
+        self.name: str = row.get("项目")
+        self.category: str = _intern(row.get("类别"))
+        self.datapoints: list[Datapoint] = []
+
+
+class Applicant:
+    __slots__ = (
+        "id",
+        "code",
+        "major",
+        "gpa",
+        "toefl",
+        "ielts",
+        "gre",
+        "areas",
+        "datapoints",
+        "destination",
+    )
+
+    def __init__(self, row: dict, major: Major):
+        self.id: str = row["_id"]
+        self.code: str = row["ID"]
+        self.major = major
+        self.gpa: float = _number(row.get("GPA"))
+        # TOEFL and IELTS scores share a column, IELTS scores are at most 9
+        language = _number(row.get("TOEFL/IELTS 总分"))
+        self.toefl: float = language if language is not None and language > 9 else None
+        self.ielts: float = language if language is not None and language <= 9 else None
+        self.gre: float = _number(row.get("GRE 总分 (V+Q)"))
+        self.areas: tuple[str, ...] = tuple(
+            _intern(area) for area in row.get("申请方向") or []
+        )
+        self.datapoints: list[Datapoint] = []
+        # program of the datapoint marked as the final destination, if any
+        self.destination: Program = None
+
+
+class Datapoint:
+    __slots__ = (
+        "id",
+        "code",
+        "applicant",
+        "program",
+        "year",
+        "semester",
+        "result",
+        "final",
+    )
+
+    def __init__(self, row: dict, applicant: Applicant, program: Program):
+        self.id: str = row["_id"]
+        self.code: str = row["ID"]
+        self.applicant = applicant
+        self.program = program
+        self.year: int = row.get("学年")
+        self.semester: str = _intern(row.get("学期"))
+        self.result: str = _intern(row.get("结果"))
+        self.final: bool = bool(row.get("最终去向"))
+
+    @property
+    def term(self) -> tuple[int, str]:
+        return (self.year, self.semester)
+
+
+class Records:
+    """
+    Typed view of the tables, with links resolved to the linked records.
+
+    Records only keep the columns used to aggregate the data; pages are still
+    rendered from the row dicts. Built by `from_rows` from rows that passed
+    `filter_out_invalid`, so that every link resolves.
+    """
+
+    __slots__ = ("applicants", "datapoints", "programs", "majors")
+
+    def __init__(self):
+        self.applicants: dict[str, Applicant] = {}
+        self.datapoints: dict[str, Datapoint] = {}
+        self.programs: dict[str, Program] = {}
+        self.majors: dict[str, Major] = {}
+
+
+def from_rows(
+    applicants: dict, datapoints: dict, programs: dict, majors: dict
+) -> Records:
+    """
+    Adapt rows returned by the API, after `_rebuild_relations`, to `Records`.
+    Every record keeps the order of rows and links of the tables.
+    """
+    records = Records()
+    for id, row in majors.items():
+        records.majors[id] = Major(row)
+    for id, row in programs.items():
+        records.programs[id] = Program(row)
+    for id, row in applicants.items():
+        records.applicants[id] = Applicant(
+            row, records.majors[row["专业"][0]["row_id"]]
+        )
+    for id, row in datapoints.items():
+        records.datapoints[id] = Datapoint(
+            row,
+            records.applicants[row["申请人"][0]["row_id"]],
+            records.programs[row["项目"][0]["row_id"]],
+        )
+
+    for major in records.majors.values():
+        major.applicants = [
+            records.applicants[link["row_id"]]
+            for link in majors[major.id].get("申请人", [])
+        ]
+    for program in records.programs.values():
+        program.datapoints = [
+            records.datapoints[id]
+            for id in programs[program.id]["数据点"]
+            if id in records.datapoints
+        ]
+    for applicant in records.applicants.values():
+        applicant.datapoints = [
+            records.datapoints[id] for id in applicants[applicant.id]["数据点"]
+        ]
+        for datapoint in applicant.datapoints:
+            if datapoint.final:
+                applicant.destination = datapoint.program
+
+    return records
@@ -0,0 +1,61 @@
+from .models import Records
+
+
+class RelationIndex:
+    """
+    Index of the relations between records, built once after filtering, so
+    that per-entity aggregates are dictionary lookups instead of scans over all
+    rows.
+
+    `applicants_by_term` is the list of `(term, applicant ids)` pairs shared by
+    the frontends; the per-term lists below keep its order.
+    """
+
+    def __init__(self, records: Records, applicants_by_term: list[tuple[tuple, list]]):
+        # applicant -> major
+        self.applicant_major: dict[str, str] = {
+            id: applicant.major.id for id, applicant in records.applicants.items()
+        }
+
+        # applicant -> programs they applied to, without duplicates
+        self.applicant_programs: dict[str, dict[str, None]] = {
+            id: {datapoint.program.id: None for datapoint in applicant.datapoints}
+            for id, applicant in records.applicants.items()
+        }
+
+        # program -> datapoints, program -> applicants (in order of datapoints)
+        self.program_datapoints: dict[str, list[str]] = {
+            id: [datapoint.id for datapoint in program.datapoints]
+            for id, program in records.programs.items()
+        }
+        self.program_applicants: dict[str, list[str]] = {
+            id: list({datapoint.applicant.id: None for datapoint in program.datapoints})
+            for id, program in records.programs.items()
+        }
+
+        # (term, major) -> applicants, (term, program) -> applicants
+        self.term_major_applicants: dict[tuple, list[str]] = {}
+        self.term_program_applicants: dict[tuple, list[str]] = {}
+        for term, term_applicants in applicants_by_term:
+            for applicant_id in term_applicants:
+                self.term_major_applicants.setdefault(
+                    (term, self.applicant_major[applicant_id]), []
+                ).append(applicant_id)
+                for program_id in self.applicant_programs[applicant_id]:
+                    self.term_program_applicants.setdefault(
+                        (term, program_id), []
+                    ).append(applicant_id)
+
+        self.terms = [term for term, _ in applicants_by_term]
+
+    def major_applicants_by_term(self, major_id: str) -> list[tuple[tuple, list]]:
+        return [
+            (term, self.term_major_applicants.get((term, major_id), []))
+            for term in self.terms
+        ]
+
+    def program_applicants_by_term(self, program_id: str) -> list[tuple[tuple, list]]:
+        return [
+            (term, self.term_program_applicants.get((term, program_id), []))
+            for term in self.terms
+        ]
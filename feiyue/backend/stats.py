@@ -0,0 +1,197 @@
+import collections
+import hashlib
+import statistics
+
+from . import term_value
+from .models import Records
+
+# bumped whenever the statistics computed change, to invalidate saved ones
+STATS_VERSION = 2
+
+RESULTS = ("Admit", "Reject", "Withdraw")
+UNKNOWN = "Unknown"
+SCORES = ("gpa", "toefl", "ielts", "gre")
+
+
+def fingerprint(records: Records) -> str:
+    """
+    Digest of the fields of the records that `compute` reads, changing whenever
+    the statistics may change. The records are already typed (e.g. scores
+    entered as text are numbers), and hold only the columns aggregated, so this
+    is much cheaper than digesting the rows.
+    """
+    digest = hashlib.sha256(str(STATS_VERSION).encode())
+    for values in (
+        records.programs.keys(),
+        records.majors.keys(),
+        (
+            (applicant.id, applicant.major.id)
+            + tuple(getattr(applicant, score) for score in SCORES)
+            for applicant in records.applicants.values()
+        ),
+        (
+            (
+                datapoint.id,
+                datapoint.applicant.id,
+                datapoint.program.id,
+                datapoint.year,
+                datapoint.semester,
+                datapoint.result,
+                datapoint.final,
+            )
+            for datapoint in records.datapoints.values()
+        ),
+    ):
+        digest.update(repr(list(values)).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def compute(records: Records) -> dict:
+    """
+    Compute from the datapoints, counted in a single pass:
+
+    - `programs`: for each program, the number of datapoints with each result
+      and their rates, the same for each term it was applied to, and the
+      distribution of the scores of its applicants
+    - `majors`: for each major, the distribution of the scores of its
+      applicants, and the programs they went to (most frequent first)
+    - `terms`: the results of all datapoints of each term
+
+    Distributions are quantiles (see `quantiles`), and terms are in
+    chronological order. The result only holds ids, numbers and strings, so
+    that it can be saved as JSON.
+    """
+    # counted with `Counter` over the datapoints, then summed up by key
+    term_program_results = collections.Counter(
+        (
+            datapoint.program.id,
+            datapoint.term,
+            datapoint.result if datapoint.result in RESULTS else UNKNOWN,
+        )
+        for datapoint in records.datapoints.values()
+    )
+    flows = collections.Counter(
+        (datapoint.applicant.major.id, datapoint.program.id)
+        for datapoint in records.datapoints.values()
+        if datapoint.final
+    )
+    # applicants count once per program and major, however many datapoints
+    program_applicants = {
+        (datapoint.program.id, datapoint.applicant): None
+        for datapoint in records.datapoints.values()
+    }
+    major_applicants = {
+        datapoint.applicant: None for datapoint in records.datapoints.values()
+    }
+
+    program_results: dict[str, dict] = {id: {} for id in records.programs}
+    program_term_results: dict[str, dict] = {id: {} for id in records.programs}
+    term_results: dict[tuple, dict] = {}
+    for (program, term, result), count in term_program_results.items():
+        _add(program_results[program], result, count)
+        _add(program_term_results[program].setdefault(term, {}), result, count)
+        _add(term_results.setdefault(term, {}), result, count)
+
+    program_scores = {id: {score: [] for score in SCORES} for id in records.programs}
+    for program, applicant in program_applicants:
+        _add_scores(program_scores[program], applicant)
+    major_scores = {id: {score: [] for score in SCORES} for id in records.majors}
+    for applicant in major_applicants:
+        _add_scores(major_scores[applicant.major.id], applicant)
+
+    destinations: dict[str, dict] = {id: {} for id in records.majors}
+    for (major, program), count in flows.items():
+        destinations[major][program] = count
+
+    return {
+        "programs": {
+            id: {
+                "results": _rates(program_results[id]),
+                "terms": [
+                    [year, semester, _rates(results)]
+                    for (year, semester), results in _by_term(program_term_results[id])
+                ],
+                "scores": _distributions(program_scores[id]),
+            }
+            for id in records.programs
+        },
+        "majors": {
+            id: {
+                "scores": _distributions(major_scores[id]),
+                "destinations": [
+                    [program, count]
+                    for program, count in sorted(
+                        destinations[id].items(), key=lambda x: x[1], reverse=True
+                    )
+                ],
+            }
+            for id in records.majors
+        },
+        "terms": [
+            [year, semester, _rates(results)]
+            for (year, semester), results in _by_term(term_results)
+        ],
+    }
+
+
+def quantiles(values: list[float]) -> dict:
+    """
+    Count, minimum, quartiles and maximum of `values`, with the quartiles
+    interpolated between values as `statistics.quantiles(method="inclusive")`
+    does. None if `values` is empty.
+    """
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+
+    def quantile(q: float) -> float:
+        position = (len(values) - 1) * q
+        lower = int(position)
+        upper = min(lower + 1, len(values) - 1)
+        return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+    def tidy(value: float) -> float:
+        # integer scores (e.g. TOEFL) stay integers where possible
+        value = round(value, 2)
+        return int(value) if integers and value == int(value) else value
+
+    integers = all(isinstance(value, int) for value in values)
+    return {
+        "count": len(values),
+        "min": values[0],
+        "q1": tidy(quantile(0.25)),
+        "median": tidy(statistics.median(values)),
+        "q3": tidy(quantile(0.75)),
+        "max": values[-1],
+    }
+
+
+def _add(counts: dict, key, count: int):
+    counts[key] = counts.get(key, 0) + count
+
+
+def _add_scores(scores: dict, applicant):
+    for score in SCORES:
+        value = getattr(applicant, score)
+        if value is not None:
+            scores[score].append(value)
+
+
+def _rates(results: dict) -> dict:
+    counts = dict.fromkeys(RESULTS + (UNKNOWN,), 0)
+    counts.update(results)
+    total = sum(counts.values())
+    return {
+        "total": total,
+        "counts": counts,
+        "rates": {result: round(counts[result] / total, 4) for result in RESULTS},
+    }
+
+
+def _by_term(results: dict) -> list:
+    return sorted(results.items(), key=lambda x: term_value(*x[0]))
+
+
+def _distributions(scores: dict) -> dict:
+    return {score: quantiles(values) for score, values in scores.items()}
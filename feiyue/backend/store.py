@@ -0,0 +1,183 @@
+import json
+import sqlite3
+from pathlib import Path
+
+SCHEMA_VERSION = 1
+
+# SeaTable table -> SQLite table
+_table_names = {
+    "申请人": "applicants",
+    "数据点": "datapoints",
+    "项目": "programs",
+    "本科专业": "majors",
+}
+
+
+class RowStore:
+    """
+    Local SQLite store of the rows of every SeaTable table, of the sync
+    watermarks, and of the statistics computed from the rows.
+
+    Each SeaTable table has its own SQLite table, keeping the rows as returned
+    by the API (in JSON) in their original order. Link columns are indexed in
+    `links`, so rows can be looked up by the rows they link to. Every save is a
+    single transaction, so an interrupted sync leaves the previous rows intact.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self._migrate()
+
+    def close(self):
+        self.connection.close()
+
+    def _migrate(self):
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version == SCHEMA_VERSION:
+            return
+
+        # the store is a cache of SeaTable, so start over on other versions
+        with self.connection:
+            for name in list(_table_names.values()) + ["links", "meta"]:
+                self.connection.execute(f"DROP TABLE IF EXISTS {name}")
+            for name in _table_names.values():
+                self.connection.execute(f"""
+                    CREATE TABLE {name} (
+                        row_id TEXT PRIMARY KEY,
+                        position INTEGER NOT NULL,
+                        mtime TEXT,
+                        data TEXT NOT NULL
+                    )
+                    """)
+            self.connection.execute("""
+                CREATE TABLE links (
+                    source_table TEXT NOT NULL,
+                    source_id TEXT NOT NULL,
+                    link_column TEXT NOT NULL,
+                    target_id TEXT NOT NULL
+                )
+                """)
+            self.connection.execute(
+                "CREATE INDEX links_by_target "
+                "ON links (source_table, link_column, target_id)"
+            )
+            self.connection.execute(
+                "CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def has_rows(self) -> bool:
+        return self._get_meta("watermarks") is not None
+
+    def load(self, tables: list[str] = None) -> dict[str, dict]:
+        """
+        Load the rows of `tables` (all tables by default), keyed by table name
+        and then by row id.
+        """
+        rows_by_table = {}
+        for table in tables if tables is not None else _table_names:
+            cursor = self.connection.execute(
+                f"SELECT row_id, data FROM {_table_names[table]} ORDER BY position"
+            )
+            rows_by_table[table] = {id: json.loads(data) for id, data in cursor}
+        return rows_by_table
+
+    def get_row(self, table: str, row_id: str) -> dict:
+        row = self.connection.execute(
+            f"SELECT data FROM {_table_names[table]} WHERE row_id = ?", (row_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def get_linked_rows(self, table: str, column: str, target_id: str) -> list[dict]:
+        """
+        Return the rows of `table` whose link `column` links to `target_id`,
+        e.g. the datapoints of an applicant with `("数据点", "申请人", id)`.
+        """
+        cursor = self.connection.execute(
+            f"""
+            SELECT data FROM {_table_names[table]} WHERE row_id IN (
+                SELECT source_id FROM links
+                WHERE source_table = ? AND link_column = ? AND target_id = ?
+            ) ORDER BY position
+            """,
+            (table, column, target_id),
+        )
+        return [json.loads(data) for data, in cursor]
+
+    def get_watermarks(self) -> dict[str, str]:
+        watermarks = self._get_meta("watermarks")
+        return json.loads(watermarks) if watermarks is not None else {}
+
+    def save(self, rows_by_table: dict[str, dict], watermarks: dict[str, str]):
+        """
+        Replace the rows of the tables in `rows_by_table` and the watermarks, in
+        one transaction.
+        """
+        with self.connection:
+            for table, rows in rows_by_table.items():
+                name = _table_names[table]
+                self.connection.execute(f"DELETE FROM {name}")
+                self.connection.execute(
+                    "DELETE FROM links WHERE source_table = ?", (table,)
+                )
+                self.connection.executemany(
+                    f"INSERT INTO {name} VALUES (?, ?, ?, ?)",
+                    (
+                        (
+                            id,
+                            position,
+                            row.get("_mtime"),
+                            json.dumps(row, ensure_ascii=False),
+                        )
+                        for position, (id, row) in enumerate(rows.items())
+                    ),
+                )
+                self.connection.executemany(
+                    "INSERT INTO links VALUES (?, ?, ?, ?)",
+                    (
+                        (table, id, column, link["row_id"])
+                        for id, row in rows.items()
+                        for column, value in row.items()
+                        if _is_link(value)
+                        for link in value
+                    ),
+                )
+            self._set_meta("watermarks", json.dumps(watermarks))
+
+    def get_statistics(self, fingerprint: str) -> dict:
+        """
+        Return the statistics saved with `save_statistics` if they were computed
+        from rows with the same `fingerprint`, or None.
+        """
+        saved = self._get_meta("statistics")
+        if saved is None:
+            return None
+        saved = json.loads(saved)
+        return saved["statistics"] if saved["fingerprint"] == fingerprint else None
+
+    def save_statistics(self, fingerprint: str, statistics: dict):
+        with self.connection:
+            self._set_meta(
+                "statistics",
+                json.dumps({"fingerprint": fingerprint, "statistics": statistics}),
+            )
+
+    def _get_meta(self, key: str) -> str:
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def _set_meta(self, key: str, value: str):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value)
+        )
+
+
+def _is_link(value) -> bool:
+    return (
+        isinstance(value, list)
+        and len(value) > 0
+        and all(isinstance(link, dict) and "row_id" in link for link in value)
+    )
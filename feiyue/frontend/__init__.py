@@ -1,24 +1,337 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
 import json
+import multiprocessing
 import os
-import shutil
 from pathlib import Path
-import statistics
+import re
+from types import MappingProxyType
 
-from ..backend import term_value
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from .. import profiler as profiling
+from ..backend import models, stats, term_value
+from ..backend.relations import RelationIndex
+from ..backend.store import RowStore
+from . import search
+from .fragments import FragmentCache
+from .output import OutputWriter
 
 
 class Frontend:
-    def __init__(self, output_dir, template_dir, resource_dir):
+    # families of pages with one page per row, rendered by `_build_<family>_page`,
+    # and the position of their table in the arguments of `build`
+    page_families: list[tuple[str, int]] = []
+    # name of the frontend, distinguishing its build manifest in the output dir
+    name = None
+    # macros of `macros.jinja` rendering a fragment of a single entity (e.g. its
+    # link), memoized for the whole build
+    fragment_macros: list[str] = []
+    # whether templates escape HTML in the values they output
+    autoescape = False
+
+    def __init__(
+        self,
+        output_dir,
+        template_dir,
+        resource_dir,
+        profiler: profiling.Profiler = profiling.disabled,
+        template_cache_dir: Path = None,
+        stats_store: RowStore = None,
+    ):
         self.output_dir = output_dir
+        self.profiler = profiler
         self.template_dir = template_dir
+        self.template_cache_dir = template_cache_dir
+        self.stats_store = stats_store
+        self.env: Environment = None
+        self.fragments: FragmentCache = None
         self.resource_dir = resource_dir
+        self.output = OutputWriter(
+            output_dir, Path(output_dir) / f".{self.name}-manifest.json"
+        )
 
     def pre_build(self):
         pass
 
-    def build(self, applicants, datapoints, programs, majors):
+    def _get_environment(self) -> Environment:
+        """
+        Return the Jinja environment shared by all templates of the frontend,
+        created on first use.
+
+        Templates are compiled once per build and never checked for changes
+        (`auto_reload` is off), so imports of `macros.jinja` reuse the compiled
+        module. If `template_cache_dir` is given, the compiled bytecode is kept
+        there across builds; Jinja stores a checksum of the source with it, so
+        an edited template is compiled again.
+        """
+        if self.env is None:
+            bytecode_cache = None
+            if self.template_cache_dir is not None:
+                Path(self.template_cache_dir).mkdir(parents=True, exist_ok=True)
+                bytecode_cache = FileSystemBytecodeCache(str(self.template_cache_dir))
+            self.env = Environment(
+                loader=FileSystemLoader(self.template_dir),
+                bytecode_cache=bytecode_cache,
+                auto_reload=False,
+                autoescape=self.autoescape,
+                # keep every template, there are only a few
+                cache_size=-1,
+            )
+        return self.env
+
+    def _memoize_fragments(self):
+        """
+        Memoize the `fragment_macros`, once the environment has all its filters.
+        """
+        if self.fragments is None:
+            module = self._get_environment().get_template("macros.jinja").module
+            self.fragments = FragmentCache(module, self.fragment_macros)
+
+    def build(self, applicants, datapoints, programs, majors, jobs=1):
         pass
 
+    def _page_path(self, family: str, row: dict) -> Path:
+        raise NotImplementedError
+
+    def _build_row_pages(self, tables: tuple, jobs: int = 1):
+        """
+        Build the pages of all `page_families` whose inputs changed since the
+        last build, in `jobs` processes if more than one.
+
+        Workers are forked after preprocessing, so they share the preprocessed
+        data and the compiled templates with this process instead of receiving a
+        copy.
+        """
+        with self.profiler.stage("check page inputs"):
+            stale_pages = self._get_stale_pages(tables)
+        print(
+            f"Rendering {sum(len(ids) for _, _, ids in stale_pages)} of "
+            f"{sum(len(tables[table]) for _, table in self.page_families)} pages"
+        )
+
+        if jobs > 1 and "fork" not in multiprocessing.get_all_start_methods():
+            print("Building in parallel needs fork(), building serially instead")
+            jobs = 1
+
+        if jobs <= 1:
+            for family, table, ids in stale_pages:
+                build_page = getattr(self, f"_build_{family}_page")
+                with self.profiler.stage(f"render {family} pages") as stage:
+                    for id in ids:
+                        build_page(tables[table][id], *tables)
+                    stage["items"] = len(ids)
+            return
+
+        # families are rendered together, so only their total is profiled
+        with self.profiler.stage("render pages") as stage, ProcessPoolExecutor(
+            jobs,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(self, tables),
+        ) as executor:
+            futures = []
+            for family, table, ids in stale_pages:
+                chunk_size = max(len(ids) // (jobs * 4), 1)
+                futures += [
+                    executor.submit(
+                        _build_pages_chunk, family, table, ids[i : i + chunk_size]
+                    )
+                    for i in range(0, len(ids), chunk_size)
+                ]
+            for future in futures:
+                self.output.merge_records(future.result())
+            stage["items"] = sum(len(ids) for _, _, ids in stale_pages)
+
+    def _get_stale_pages(self, tables: tuple) -> list[tuple[str, int, list[str]]]:
+        """
+        Return the ids of the rows of each page family whose page must be
+        rendered again, i.e. the page does not exist or any row it reads, or any
+        template, changed since the last build. Other pages are kept as is.
+        """
+        self._digest_inputs(tables)
+        stale_pages = []
+        for family, table in self.page_families:
+            ids = []
+            for id, row in tables[table].items():
+                if not self._up_to_date(
+                    self._page_path(family, row),
+                    self._get_page_inputs(family, row, tables),
+                ):
+                    ids.append(id)
+            stale_pages.append((family, table, ids))
+        return stale_pages
+
+    def _digest_inputs(self, tables: tuple):
+        """
+        Digest the templates and every row, once rows are preprocessed, for
+        `_up_to_date`.
+        """
+        templates = hashlib.sha256()
+        for path in sorted(Path(self.template_dir).rglob("*")):
+            if path.is_file():
+                templates.update(
+                    path.relative_to(self.template_dir).as_posix().encode()
+                )
+                templates.update(path.read_bytes())
+        self.templates_digest = templates.digest()
+
+        self.row_digests = [
+            {
+                id: hashlib.sha256(
+                    json.dumps(
+                        row, ensure_ascii=False, sort_keys=True, default=str
+                    ).encode()
+                ).hexdigest()
+                for id, row in rows.items()
+            }
+            for rows in tables
+        ]
+
+    def _up_to_date(
+        self, path: Path, inputs: list[tuple[int, str]], key: list = None
+    ) -> bool:
+        """
+        Check whether the page at `path` is up to date, i.e. it was built by the
+        previous build from the same templates, the same `inputs` rows (see
+        `_get_page_inputs`) and the same `key` (anything else the page shows,
+        as JSON), and if so keep it as is.
+        """
+        fingerprint = hashlib.sha256(self.templates_digest)
+        if key is not None:
+            fingerprint.update(json.dumps(key, ensure_ascii=False).encode())
+        for input_table, input_id in inputs:
+            fingerprint.update(
+                f"{input_table}:{input_id}:"
+                f"{self.row_digests[input_table].get(input_id)}\n".encode()
+            )
+        return self.output.up_to_date(path, fingerprint.hexdigest())
+
+    def _get_page_inputs(
+        self, family: str, row: dict, tables: tuple
+    ) -> list[tuple[int, str]]:
+        """
+        Return the `(table, row id)` pairs of the rows read by the page of `row`,
+        including the row itself. Tables are positions in the arguments of
+        `build`.
+        """
+        applicants = tables[0]
+        id = row["_id"]
+        if family == "applicant":
+            return (
+                [(0, id), (3, self.relations.applicant_major[id])]
+                + [(1, datapoint) for datapoint in row["数据点"]]
+                + [(2, program) for program in self.relations.applicant_programs[id]]
+            )
+        if family == "major":
+            inputs = [(3, id)]
+            for applicant in row.get("申请人", []):
+                applicant = applicants[applicant["row_id"]]
+                inputs.append((0, applicant["_id"]))
+                if "__destination" in applicant:
+                    inputs.append((2, applicant["__destination"]))
+            return inputs + [(2, program) for program, _ in row["__programs"]]
+        if family == "program":
+            return (
+                [(2, id)]
+                + [
+                    (1, datapoint)
+                    for datapoint in self.relations.program_datapoints[id]
+                ]
+                + [
+                    input
+                    for applicant in self.relations.program_applicants[id]
+                    for input in [
+                        (0, applicant),
+                        (3, self.relations.applicant_major[applicant]),
+                    ]
+                ]
+            )
+        raise Exception(f"Unknown page family {family}")
+
+    def _get_listing_inputs(self, applicant_ids) -> list[tuple[int, str]]:
+        """
+        Return the rows read by a listing of applicants (e.g. the applicants of a
+        term or an area): the applicants, their majors and their destinations.
+        """
+        inputs = []
+        for id in applicant_ids:
+            applicant = self.records.applicants[id]
+            inputs += [(0, id), (3, applicant.major.id)]
+            if applicant.destination is not None:
+                inputs.append((2, applicant.destination.id))
+        return inputs
+
+    def _render_term_shards(self, get_path, template, **context):
+        """
+        Render `template` for the applicants of each term (as `year`, `term` and
+        `term_applicant_ids`) to `get_path("<year>-<term>")`, if they changed
+        since the last build.
+        """
+        for (year, term), term_applicant_ids in self.applicants_by_term:
+            path = get_path(f"{year}-{term}")
+            if self._up_to_date(
+                path,
+                self._get_listing_inputs(term_applicant_ids),
+                key=term_applicant_ids,
+            ):
+                continue
+            self.output.render(
+                path,
+                template,
+                year=year,
+                term=term,
+                term_applicant_ids=term_applicant_ids,
+                **context,
+            )
+
+    def _render_area_shards(self, get_path, template, **context):
+        """
+        Render `template` for the areas of each page of `_get_area_shards` (as
+        `areas`) to `get_path(slug)`, if they changed since the last build.
+        """
+        for slug, areas in self._get_area_shards().items():
+            path = get_path(slug)
+            if self._up_to_date(
+                path,
+                self._get_listing_inputs(
+                    id for applicants in areas.values() for _, id in applicants
+                ),
+                key=areas,
+            ):
+                continue
+            self.output.render(path, template, areas=areas, **context)
+
+    def _build_search_index(
+        self, search_index_dir: Path, all_applicants, all_programs, all_majors
+    ) -> int:
+        """
+        Write the shards of the search index read by `search.js` (see
+        `search.build_index`) to `search_index_dir`. Returns the number of
+        shards.
+        """
+        shards = search.build_index(
+            self.records,
+            self.applicants_by_term,
+            self.all_areas,
+            all_applicants,
+            all_programs,
+            all_majors,
+        )
+        for name, shard in shards.items():
+            self.output.write(search_index_dir / name, search.dumps(shard))
+        return len(shards)
+
+    def _get_area_shards(self) -> dict[str, dict[str, list]]:
+        """
+        Group `all_areas` by the name of their page (see `area_slug`), so that
+        areas whose names only differ in case or punctuation share a page.
+        """
+        shards: dict[str, dict[str, list]] = {}
+        for area, applicants in self.all_areas.items():
+            shards.setdefault(area_slug(area), {})[area] = applicants
+        return shards
+
     def copy_resources(self, link):
         with open(self.resource_dir / "manifest.json", "r") as f:
             manifest: dict = json.load(f)
@@ -28,118 +341,172 @@ class Frontend:
                 if os.path.islink(self.output_dir / dest):
                     os.remove(self.output_dir / dest)
                 os.symlink(self.resource_dir / src, self.output_dir / dest)
+                self.output.keep(self.output_dir / dest)
             elif os.path.isfile(self.resource_dir / src):
-                shutil.copy(self.resource_dir / src, self.output_dir / dest)
+                self.output.copy_file(self.resource_dir / src, self.output_dir / dest)
             elif os.path.isdir(self.resource_dir / src):
-                shutil.copytree(
-                    self.resource_dir / src,
-                    self.output_dir / dest,
-                    dirs_exist_ok=True,
-                )
+                self.output.copy_tree(self.resource_dir / src, self.output_dir / dest)
             else:
                 raise Exception(f"Resource {src} not exist")
 
     def copy_images(self, image_dir: Path):
         raise NotImplementedError
 
+    def finish(self) -> dict[str, int]:
+        """
+        Remove output of rows that no longer exist and save the build manifest.
+        Returns the number of files added, changed, unchanged and removed.
+        """
+        return self.output.finish()
+
     def _preprocess(self, all_applicants, all_datapoints, all_programs, all_majors):
-        self._set_applicants_by_term(all_datapoints, all_applicants)
-        self.all_areas = self._get_areas(all_applicants)
+        if self.fragments is not None:
+            # fragments of the rows of a previous build may be outdated
+            self.fragments.clear()
+        self.records = models.from_rows(
+            all_applicants, all_datapoints, all_programs, all_majors
+        )
+        self._set_applicants_by_term(self.records)
+        self.all_areas = self._get_areas(self.records)
+        self.relations = RelationIndex(self.records, self.applicants_by_term)
+        self.stats = self._get_statistics()
         # get top programs & terms & GPA median & total programs for each major
         # get final destination for each applicant
-        for major in all_majors.values():
-            major["__applicants_by_term"] = [
-                (
-                    term,
-                    [
-                        applicant
-                        for applicant in applicants
-                        if all_applicants[applicant]["专业"][0]["row_id"]
-                        == major["_id"]
-                    ],
-                )
-                for term, applicants in self.applicants_by_term
-            ]
-
-            major["__programs"] = {}
-            major["__program_count"] = 0
-            gpas = []
-            for applicant in major.get("申请人", []):
-                applicant = all_applicants[applicant["row_id"]]
-                for datapoint in applicant.get("数据点", []):
-                    datapoint = all_datapoints[datapoint]
-                    if datapoint["项目"][0]["row_id"] not in major["__programs"]:
-                        major["__programs"][datapoint["项目"][0]["row_id"]] = 0
-                    major["__programs"][datapoint["项目"][0]["row_id"]] += 1
-                    major["__program_count"] += 1
-
-                    if "最终去向" in datapoint and datapoint["最终去向"]:
-                        applicant["__destination"] = datapoint["项目"][0]["row_id"]
-
-                if applicant.get("GPA") is not None:
-                    gpas.append(applicant["GPA"])
-
-            major["__programs"] = sorted(
-                list(major["__programs"].items()), key=lambda x: x[1], reverse=True
+        for major in self.records.majors.values():
+            row = all_majors[major.id]
+            row["__applicants_by_term"] = self.relations.major_applicants_by_term(
+                major.id
             )
-            major["__gpa_median"] = (
-                round(statistics.median(gpas), 2) if len(gpas) > 0 else None
+
+            programs: dict[str, int] = {}
+            for applicant in major.applicants:
+                for datapoint in applicant.datapoints:
+                    programs[datapoint.program.id] = (
+                        programs.get(datapoint.program.id, 0) + 1
+                    )
+
+                if applicant.destination is not None:
+                    all_applicants[applicant.id][
+                        "__destination"
+                    ] = applicant.destination.id
+
+            row["__programs"] = sorted(
+                list(programs.items()), key=lambda x: x[1], reverse=True
             )
+            row["__program_count"] = sum(programs.values())
+            row["__stats"] = self.stats["majors"][major.id]
+            gpa = row["__stats"]["scores"]["gpa"]
+            row["__gpa_median"] = gpa["median"] if gpa is not None else None
 
-        # get terms for each program
+        # get terms & statistics for each program
         for program in all_programs.values():
-            program["__applicants_by_term"] = [
-                (
-                    term,
-                    [
-                        applicant
-                        for applicant in applicants
-                        if any(
-                            all_datapoints[datapoint]["项目"][0]["row_id"]
-                            == program["_id"]
-                            for datapoint in all_applicants[applicant]["数据点"]
-                        )
-                    ],
+            program["__applicants_by_term"] = self.relations.program_applicants_by_term(
+                program["_id"]
+            )
+            program["__stats"] = self.stats["programs"][program["_id"]]
+
+        self._index_program_datapoints(all_datapoints)
+
+    def _get_statistics(self) -> dict:
+        """
+        Statistics of the records (see `stats.compute`), read from
+        `stats_store` if they were saved for the same rows.
+        """
+        fingerprint = stats.fingerprint(self.records)
+        if self.stats_store is not None:
+            saved = self.stats_store.get_statistics(fingerprint)
+            if saved is not None:
+                return saved
+
+        computed = stats.compute(self.records)
+        if self.stats_store is not None:
+            self.stats_store.save_statistics(fingerprint, computed)
+        return computed
+
+    def _index_program_datapoints(self, all_datapoints: dict):
+        """
+        Index the datapoints of each program, and the datapoint of each of its
+        applicants, as read-only views for the program templates.
+        """
+        self.program_datapoints: dict[str, tuple] = {}
+        self.program_applicant_datapoints: dict[str, dict] = {}
+        for program_id, datapoints in self.relations.program_datapoints.items():
+            views = tuple(MappingProxyType(all_datapoints[id]) for id in datapoints)
+            applicant_datapoints = {}
+            for datapoint in views:
+                # the first datapoint wins if an applicant applied twice
+                applicant_datapoints.setdefault(
+                    datapoint["申请人"][0]["row_id"], datapoint
                 )
-                for term, applicants in self.applicants_by_term
-            ]
+            self.program_datapoints[program_id] = views
+            self.program_applicant_datapoints[program_id] = MappingProxyType(
+                applicant_datapoints
+            )
 
-    def _set_applicants_by_term(self, datapoints: dict, applicants: dict) -> dict:
-        self.applicants_by_term = {}
+    def _set_applicants_by_term(self, records: models.Records):
+        applicants_by_term: dict[tuple, dict[models.Applicant, None]] = {}
 
-        for datapoint in datapoints.values():
-            if datapoint["学年"] is None:
+        for datapoint in records.datapoints.values():
+            if datapoint.year is None:
                 continue
-            self.applicants_by_term.setdefault(
-                (datapoint["学年"], datapoint["学期"]), set()
-            ).add((datapoint["申请人"][0]["row_id"]))
+            # a dict keeps the order of datapoints, so that builds are reproducible
+            applicants_by_term.setdefault(datapoint.term, {})[
+                datapoint.applicant
+            ] = None
 
         self.applicants_by_term = sorted(
             [
                 (
                     term,
-                    sorted(
-                        term_applicants,
-                        key=lambda x: applicants[x]["专业"][0]["row_id"],
-                    ),
+                    [
+                        applicant.id
+                        for applicant in sorted(
+                            term_applicants, key=lambda x: x.major.id
+                        )
+                    ],
                 )
-                for term, term_applicants in self.applicants_by_term.items()
+                for term, term_applicants in applicants_by_term.items()
             ],
             key=lambda x: term_value(*x[0]),
             reverse=True,
         )
-        print(self.applicants_by_term)
 
-    def _get_areas(self, all_applicants: dict) -> dict:
+    def _get_areas(self, records: models.Records) -> dict:
         all_areas: dict[str, list] = {}
         for term, applicants in self.applicants_by_term:
             for applicant in applicants:
-                applicant = all_applicants[applicant]
-                areas = applicant["申请方向"]
-                if not areas:
-                    continue
-                for area in areas:
-                    all_areas.setdefault(area, []).append((term, applicant["_id"]))
+                applicant = records.applicants[applicant]
+                for area in applicant.areas:
+                    all_areas.setdefault(area, []).append((term, applicant.id))
 
         all_areas = dict(sorted(all_areas.items(), key=lambda x: x[0]))
         return all_areas
+
+
+def area_slug(area: str) -> str:
+    """
+    Name of the page of `area`: lowercased with spaces replaced by hyphens, as
+    its anchor on the single area page used to be. Only letters, digits and
+    hyphens are kept, so that the name is safe in paths, URLs and LaTeX (e.g.
+    `\\subfile{area/<slug>.tex}`); anything else, `_` included, is replaced.
+    """
+    return re.sub(r"(?:[^\w-]|_)+", "-", area.lower()).strip("-") or "-"
+
+
+_worker_frontend: Frontend = None
+_worker_tables: tuple = None
+
+
+def _init_worker(frontend: Frontend, tables: tuple):
+    global _worker_frontend, _worker_tables
+    _worker_frontend = frontend
+    _worker_tables = tables
+    if frontend.env is None:
+        frontend.pre_build()
+
+
+def _build_pages_chunk(family: str, table: int, ids: list[str]):
+    build_page = getattr(_worker_frontend, f"_build_{family}_page")
+    for id in ids:
+        build_page(_worker_tables[table][id], *_worker_tables)
+    return _worker_frontend.output.take_records()
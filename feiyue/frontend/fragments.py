@@ -0,0 +1,62 @@
+from collections.abc import KeysView
+from types import MappingProxyType
+
+from jinja2.environment import TemplateModule
+from jinja2.runtime import Macro
+
+_PLAIN_TYPES = {str, int, float, bool, type(None)}
+
+
+class FragmentCache:
+    """
+    Memoizes the macros of a template module (e.g. `macros.jinja`), so that the
+    link, description and tags of each entity are rendered once per build,
+    however many pages show them.
+
+    A call is keyed on the macro and its arguments, rows being identified by
+    their `_id`. Rows must therefore not change while the cache is in use; it is
+    emptied with `clear` whenever the rows are preprocessed again. Calls with
+    other arguments (e.g. a `caller`) are not cached.
+    """
+
+    def __init__(self, module: TemplateModule, names: list[str]):
+        self.fragments: dict[tuple, str] = {}
+        for name in names:
+            setattr(module, name, self._memoize(name, getattr(module, name)))
+
+    def clear(self):
+        self.fragments.clear()
+
+    def _memoize(self, name: str, macro: Macro):
+        fragments = self.fragments
+
+        def call(*args, **kwargs):
+            try:
+                key = (name, *map(_get_key, args))
+                if kwargs:
+                    key += (*kwargs.keys(), *map(_get_key, kwargs.values()))
+            except _Uncacheable:
+                return macro(*args, **kwargs)
+            fragment = fragments.get(key)
+            if fragment is None:
+                fragment = fragments[key] = macro(*args, **kwargs)
+            return fragment
+
+        return call
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+def _get_key(value):
+    value_type = type(value)
+    if value_type is dict or value_type is MappingProxyType:
+        if "_id" in value:
+            return ("_id", value["_id"])
+    elif value_type in _PLAIN_TYPES:
+        return value
+    elif value_type is list or value_type is tuple or isinstance(value, KeysView):
+        if all(type(item) is str for item in value):
+            return ("items", tuple(value))
+    raise _Uncacheable
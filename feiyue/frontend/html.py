@@ -0,0 +1,281 @@
+from . import Frontend, area_slug
+from pathlib import Path
+from datetime import timezone, datetime, timedelta
+import json
+import re
+
+import markdown
+from markdown.extensions.toc import slugify_unicode
+from markupsafe import Markup
+
+# the extensions of the MkDocs site that plain Markdown has, with the same anchors
+MARKDOWN_EXTENSIONS = [
+    "tables",
+    "fenced_code",
+    "admonition",
+    "attr_list",
+    "md_in_html",
+    "toc",
+    "mdx_truly_sane_lists",
+]
+MARKDOWN_CONFIGS = {"toc": {"permalink": True, "slugify": slugify_unicode}}
+
+front_matter_re = re.compile(r"\A---\n(.*?)\n---\n", flags=re.DOTALL)
+# links between the documents of the MkDocs site, e.g. `./faq.md#anchor`
+doc_link_re = re.compile(r"\]\((?:\./)?([\w-]+)\.md(#[^)]*)?\)")
+
+
+class HtmlFrontend(Frontend):
+    """
+    Frontend for generating a static HTML site directly, without MkDocs.
+
+    Pages have the same URLs as on the MkDocs site, and only the free-text
+    fields (e.g. 申请总结) and the documents of `resources/mkdocs/docs` are
+    rendered through Markdown.
+
+    Files to be generated:
+        - index.html
+        - <document>/index.html
+        - search-index/
+            - index.json
+            - <shard>.json
+        - applicant/
+            - index.html
+            - <year>-<term>/index.html
+            - <applicant_id>/index.html
+        - major/
+            - index.html
+            - <major_id>/index.html
+        - program/
+            - index.html
+            - <program_id>/index.html
+        - area/
+            - index.html
+            - <area>/index.html
+    """
+
+    name = "html"
+    page_families = [("applicant", 0), ("major", 3), ("program", 2)]
+    fragment_macros = [
+        "get_applicant_desc",
+        "get_major_desc",
+        "get_program_icon",
+        "get_program_desc",
+        "get_major_link",
+        "get_program_link",
+        "get_applicant_link",
+        "get_datapoint_status",
+        "get_area_tags",
+    ]
+    autoescape = True
+
+    def __init__(self, output_dir, template_dir, resource_dir, **kwargs):
+        super().__init__(output_dir, template_dir, resource_dir, **kwargs)
+        self.markdown = None
+        # Markdown text -> HTML, for the whole build
+        self.markdown_fragments: dict[str, Markup] = {}
+
+    def pre_build(self):
+        self.markdown = markdown.Markdown(
+            extensions=MARKDOWN_EXTENSIONS,
+            extension_configs=MARKDOWN_CONFIGS,
+        )
+        env = self._get_environment()
+        env.filters["area_slug"] = area_slug
+        env.filters["markdown"] = self._render_markdown
+        self.applicant_template = env.get_template("applicant.jinja")
+        self.major_template = env.get_template("major.jinja")
+        self.program_template = env.get_template("program.jinja")
+        self.index_template = env.get_template("index.jinja")
+        self.applicant_index_template = env.get_template("applicant_index.jinja")
+        self.applicant_term_template = env.get_template("applicant_term.jinja")
+        self.major_index_template = env.get_template("major_index.jinja")
+        self.program_index_template = env.get_template("program_index.jinja")
+        self.area_index_template = env.get_template("area_index.jinja")
+        self.area_template = env.get_template("area.jinja")
+        self.page_template = env.get_template("page.jinja")
+        self._memoize_fragments()
+
+    def _render_markdown(self, text: str) -> Markup:
+        fragment = self.markdown_fragments.get(text)
+        if fragment is None:
+            fragment = Markup(self.markdown.reset().convert(str(text)))
+            self.markdown_fragments[text] = fragment
+        return fragment
+
+    def build(self, all_applicants, all_datapoints, all_programs, all_majors, jobs=1):
+        with self.profiler.stage("preprocess"):
+            self._preprocess(all_applicants, all_datapoints, all_programs, all_majors)
+
+        Path(self.output_dir).mkdir(exist_ok=True)
+
+        self._build_row_pages(
+            (all_applicants, all_datapoints, all_programs, all_majors), jobs
+        )
+
+        with self.profiler.stage("render index pages"):
+            self._build_index_pages(
+                all_applicants, all_datapoints, all_programs, all_majors
+            )
+            self._build_doc_pages()
+
+        with self.profiler.stage("build search index") as stage:
+            stage["items"] = self._build_search_index(
+                self.output_dir / "search-index",
+                all_applicants,
+                all_programs,
+                all_majors,
+            )
+
+    def _page_path(self, family: str, row: dict) -> Path:
+        return self.output_dir / family / row["ID"] / "index.html"
+
+    def _build_applicant_page(
+        self, applicant, all_applicants, all_datapoints, all_programs, all_majors
+    ):
+        self.output.render(
+            self._page_path("applicant", applicant),
+            self.applicant_template,
+            root="../../",
+            comments=True,
+            applicant=applicant,
+            majors=all_majors,
+            programs=all_programs,
+            datapoints=all_datapoints,
+        )
+
+    def _build_major_page(
+        self, major, all_applicants, all_datapoints, all_programs, all_majors
+    ):
+        self.output.render(
+            self._page_path("major", major),
+            self.major_template,
+            root="../../",
+            major=major,
+            applicants=all_applicants,
+            programs=all_programs,
+            datapoints=all_datapoints,
+        )
+
+    def _build_program_page(
+        self, program, all_applicants, all_datapoints, all_programs, all_majors
+    ):
+        self.output.render(
+            self._page_path("program", program),
+            self.program_template,
+            root="../../",
+            comments=True,
+            program=program,
+            majors=all_majors,
+            applicants=all_applicants,
+            program_datapoints=self.program_datapoints[program["_id"]],
+            applicant_datapoints=self.program_applicant_datapoints[program["_id"]],
+        )
+
+    def _build_index_pages(
+        self, all_applicants, all_datapoints, all_programs, all_majors
+    ):
+        sorted_majors = sorted(
+            list(all_majors.values()),
+            key=lambda x: len(x["申请人"]),
+            reverse=True,
+        )
+
+        sorted_programs = sorted(
+            list(all_programs.values()),
+            key=lambda x: len(x["数据点"]),
+            reverse=True,
+        )
+
+        self.output.render(
+            self.output_dir / "index.html",
+            self.index_template,
+            root="",
+            applicant_num=len(all_applicants),
+            major_num=len(all_majors),
+            program_num=len(all_programs),
+            area_num=len(self.all_areas),
+            # only on the home page, so that other pages stay unchanged
+            build_time=datetime.now(tz=timezone(timedelta(hours=+8))).strftime(
+                "%Y年%-m月%-d日 %H:%M"
+            ),
+        )
+
+        self.output.render(
+            self.output_dir / "applicant" / "index.html",
+            self.applicant_index_template,
+            root="../",
+            applicants_by_term=self.applicants_by_term,
+        )
+        self._render_term_shards(
+            lambda key: self.output_dir / "applicant" / key / "index.html",
+            self.applicant_term_template,
+            root="../../",
+            applicants=all_applicants,
+            majors=all_majors,
+            programs=all_programs,
+        )
+
+        self.output.render(
+            self.output_dir / "major" / "index.html",
+            self.major_index_template,
+            root="../",
+            majors=sorted_majors,
+        )
+
+        self.output.render(
+            self.output_dir / "program" / "index.html",
+            self.program_index_template,
+            root="../",
+            programs=sorted_programs,
+        )
+
+        self.output.render(
+            self.output_dir / "area" / "index.html",
+            self.area_index_template,
+            root="../",
+            all_areas=self.all_areas,
+            area_shards=self._get_area_shards(),
+        )
+        self._render_area_shards(
+            lambda slug: self.output_dir / "area" / slug / "index.html",
+            self.area_template,
+            root="../../",
+            applicants=all_applicants,
+            majors=all_majors,
+            programs=all_programs,
+        )
+
+    def _build_doc_pages(self):
+        """
+        Render the Markdown documents listed in `pages` of the resource
+        manifest, e.g. the FAQ, each to `<name>/index.html`.
+        """
+        with open(self.resource_dir / "manifest.json", "r") as f:
+            manifest: dict = json.load(f)
+
+        for src, name in manifest["pages"].items():
+            with open(self.resource_dir / src, "r") as f:
+                text = f.read()
+
+            # only the keys used by the documents, one per line
+            meta = {}
+            match = front_matter_re.match(text)
+            if match is not None:
+                text = text[match.end() :]
+                for line in match.group(1).splitlines():
+                    key, _, value = line.partition(":")
+                    meta[key.strip()] = value.strip()
+            text = doc_link_re.sub(r"](../\1/\2)", text)
+
+            self.output.render(
+                self.output_dir / name / "index.html",
+                self.page_template,
+                root="../",
+                comments=meta.get("comments") == "true",
+                title=meta.get("title", name),
+                content=self._render_markdown(text),
+            )
+
+    def copy_images(self, image_dir: Path):
+        self.output.copy_tree(image_dir, self.output_dir / "images")
@@ -1,7 +1,5 @@
 from . import Frontend
-from jinja2 import Environment, FileSystemLoader
 from pathlib import Path
-import shutil
 from datetime import timezone, datetime, timedelta
 import re
 
@@ -13,6 +11,8 @@ class LatexFrontend(Frontend):
     Files to be generated:
         - main.tex
         - all_areas.tex
+        - area/
+            - <area>.tex
         - applicant/
             - <applicant_id>.tex
         - major/
@@ -21,8 +21,23 @@ class LatexFrontend(Frontend):
             - <program_id>.tex
     """
 
-    def __init__(self, output_dir: Path, template_dir: Path, resource_dir: Path):
-        super().__init__(output_dir, template_dir, resource_dir)
+    name = "latex"
+    page_families = [("applicant", 0), ("major", 3), ("program", 2)]
+    fragment_macros = [
+        "get_applicant_desc",
+        "get_applicant_link",
+        "get_major_desc",
+        "get_major_link",
+        "get_program_desc",
+        "get_program_link",
+        "get_datapoint_status",
+        "get_area_tags",
+    ]
+
+    def __init__(
+        self, output_dir: Path, template_dir: Path, resource_dir: Path, **kwargs
+    ):
+        super().__init__(output_dir, template_dir, resource_dir, **kwargs)
         self.docs_dir = output_dir / "latex"
 
     def pre_build(self):
@@ -52,107 +67,94 @@ class LatexFrontend(Frontend):
             """
             return list_re.sub(lambda x: " " * (len(x.group(1)) * 2) + x.group(2), s)
 
-        env = Environment(loader=FileSystemLoader(self.template_dir))
+        env = self._get_environment()
         env.filters["escape"] = latex_escape
         env.filters["fix_list"] = multiply_list_spaces
         self.applicant_template = env.get_template("applicant.jinja")
         self.major_template = env.get_template("major.jinja")
         self.program_template = env.get_template("program.jinja")
-        self.area_template = env.get_template("all_areas.jinja")
+        self.all_areas_template = env.get_template("all_areas.jinja")
+        self.area_template = env.get_template("area.jinja")
         self.main_template = env.get_template("main.jinja")
+        self._memoize_fragments()
 
-    def build(self, all_applicants, all_datapoints, all_programs, all_majors):
-        self._preprocess(all_applicants, all_datapoints, all_programs, all_majors)
+    def build(self, all_applicants, all_datapoints, all_programs, all_majors, jobs=1):
+        with self.profiler.stage("preprocess"):
+            self._preprocess(all_applicants, all_datapoints, all_programs, all_majors)
 
         self.docs_dir.mkdir(exist_ok=True, parents=True)
 
-        self._build_applicant_pages(
-            all_applicants, all_datapoints, all_programs, all_majors
-        )
-
-        self._build_major_pages(
-            all_applicants, all_datapoints, all_programs, all_majors
-        )
-
-        self._build_program_pages(
-            all_applicants, all_datapoints, all_programs, all_majors
+        self._build_row_pages(
+            (all_applicants, all_datapoints, all_programs, all_majors), jobs
         )
 
-        self._build_area_page(all_applicants, all_datapoints, all_programs, all_majors)
-
-        self._build_main_page(all_applicants, all_datapoints, all_programs, all_majors)
+        with self.profiler.stage("render index pages"):
+            self._build_area_page(
+                all_applicants, all_datapoints, all_programs, all_majors
+            )
 
-    def _build_applicant_pages(
-        self, all_applicants, all_datapoints, all_programs, all_majors
-    ):
-        for applicant in all_applicants.values():
-            applicant_tex = self.applicant_template.render(
-                applicant=applicant,
-                majors=all_majors,
-                programs=all_programs,
-                datapoints=all_datapoints,
+            self._build_main_page(
+                all_applicants, all_datapoints, all_programs, all_majors
             )
 
-            output_path = self.docs_dir / "applicant" / f"{applicant['ID']}.tex"
-            output_path.parent.mkdir(exist_ok=True)
-            with open(output_path, "w") as f:
-                f.write(applicant_tex)
+    def _page_path(self, family: str, row: dict) -> Path:
+        return self.docs_dir / family / f"{row['ID']}.tex"
 
-    def _build_major_pages(
-        self, all_applicants, all_datapoints, all_programs, all_majors
+    def _build_applicant_page(
+        self, applicant, all_applicants, all_datapoints, all_programs, all_majors
     ):
-        for major in all_majors.values():
-            major_tex = self.major_template.render(
-                major=major,
-                applicants=all_applicants,
-                datapoints=all_datapoints,
-                programs=all_programs,
-            )
-
-            output_path = self.docs_dir / "major" / f"{major['ID']}.tex"
-            output_path.parent.mkdir(exist_ok=True)
-            with open(output_path, "w") as f:
-                f.write(major_tex)
+        self.output.render(
+            self._page_path("applicant", applicant),
+            self.applicant_template,
+            applicant=applicant,
+            majors=all_majors,
+            programs=all_programs,
+            datapoints=all_datapoints,
+        )
 
-    def _build_program_pages(
-        self, all_applicants, all_datapoints, all_programs, all_majors
+    def _build_major_page(
+        self, major, all_applicants, all_datapoints, all_programs, all_majors
     ):
-        for program in all_programs.values():
-            # do this work outside of jinja2 -- it's too complicated
-            program_datapoints = all_datapoints.copy()
-            program_datapoints = [
-                datapoint
-                for datapoint in all_datapoints.values()
-                if datapoint["项目"][0]["row_id"] == program["_id"]
-            ]
-            for datapoint in program_datapoints:
-                datapoint["申请人"] = datapoint["申请人"][0]["row_id"]
-
-            program_tex = self.program_template.render(
-                program=program,
-                majors=all_majors,
-                applicants=all_applicants,
-                datapoints=all_datapoints,
-                program_datapoints=program_datapoints,
-            )
+        self.output.render(
+            self._page_path("major", major),
+            self.major_template,
+            major=major,
+            applicants=all_applicants,
+            datapoints=all_datapoints,
+            programs=all_programs,
+        )
 
-            output_path = self.docs_dir / "program" / f"{program['ID']}.tex"
-            output_path.parent.mkdir(exist_ok=True)
-            with open(output_path, "w") as f:
-                f.write(program_tex)
+    def _build_program_page(
+        self, program, all_applicants, all_datapoints, all_programs, all_majors
+    ):
+        self.output.render(
+            self._page_path("program", program),
+            self.program_template,
+            program=program,
+            majors=all_majors,
+            applicants=all_applicants,
+            datapoints=all_datapoints,
+            program_datapoints=self.program_datapoints[program["_id"]],
+            applicant_datapoints=self.program_applicant_datapoints[program["_id"]],
+        )
 
     def _build_area_page(
         self, all_applicants, all_datapoints, all_programs, all_majors
     ):
-        area_tex = self.area_template.render(
-            all_areas=self.all_areas,
+        # all_areas.tex includes a file for each area
+        area_shards = self._get_area_shards()
+        self.output.render(
+            self.docs_dir / "all_areas.tex",
+            self.all_areas_template,
+            area_shards=area_shards,
+        )
+        self._render_area_shards(
+            lambda slug: self.docs_dir / "area" / f"{slug}.tex",
+            self.area_template,
             applicants=all_applicants,
             majors=all_majors,
             programs=all_programs,
-            datapoints=all_datapoints,
         )
-        with open(self.docs_dir / "all_areas.tex", "w") as f:
-            f.write(area_tex)
 
     def _build_main_page(
         self, all_applicants, all_datapoints, all_programs, all_majors
@@ -168,7 +170,9 @@ class LatexFrontend(Frontend):
             reverse=True,
         )
 
-        main_latex = self.main_template.render(
+        self.output.render(
+            self.docs_dir / "main.tex",
+            self.main_template,
             applicants_by_term=self.applicants_by_term,
             applicants=all_applicants,
             programs=sorted_programs,
@@ -177,8 +181,6 @@ class LatexFrontend(Frontend):
                 "%Y年%-m月%-d日"
             ),
         )
-        with open(self.docs_dir / "main.tex", "w") as f:
-            f.write(main_latex)
 
     def copy_images(self, image_dir: Path):
-        shutil.copytree(image_dir, self.docs_dir / "images", dirs_exist_ok=True)
+        self.output.copy_tree(image_dir, self.docs_dir / "images")
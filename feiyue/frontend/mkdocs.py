@@ -1,8 +1,6 @@
-from . import Frontend
-from jinja2 import Environment, FileSystemLoader
+from . import Frontend, area_slug
 from pathlib import Path
 from datetime import timezone, datetime, timedelta
-import shutil
 
 
 class MkDocsFrontend(Frontend):
@@ -12,9 +10,16 @@ class MkDocsFrontend(Frontend):
     File to be generated:
         - docs/
             - index.md
-            - area.md
+            - area/
+                - index.md
+                - <area>.md
+            - search-index/
+                - index.json
+                - <shard>.json
             - applicant/
                 - index.md
+                - <year>-<term>/
+                    - index.md
                 - <applicant_id>.md
             - major/
                 - index.md
@@ -25,109 +30,111 @@ class MkDocsFrontend(Frontend):
         - mkdocs.yml
     """
 
-    def __init__(self, output_dir, template_dir, resource_dir):
-        super().__init__(output_dir, template_dir, resource_dir)
+    name = "mkdocs"
+    page_families = [("applicant", 0), ("major", 3), ("program", 2)]
+    fragment_macros = [
+        "get_applicant_desc",
+        "get_major_desc",
+        "get_program_icon",
+        "get_program_desc",
+        "get_major_link",
+        "get_program_link",
+        "get_applicant_link",
+        "get_datapoint_status",
+        "get_area_tags",
+    ]
+
+    def __init__(self, output_dir, template_dir, resource_dir, **kwargs):
+        super().__init__(output_dir, template_dir, resource_dir, **kwargs)
         self.mkdocs_docs_dir = output_dir / "docs"
 
     def pre_build(self):
-        env = Environment(loader=FileSystemLoader(self.template_dir))
+        env = self._get_environment()
+        env.filters["area_slug"] = area_slug
         self.applicant_template = env.get_template("applicant.jinja")
         self.major_template = env.get_template("major.jinja")
         self.program_template = env.get_template("program.jinja")
         self.mkdocs_template = env.get_template("mkdocs_config.jinja")
         self.index_template = env.get_template("index.jinja")
         self.applicant_index_template = env.get_template("applicant_index.jinja")
+        self.applicant_term_template = env.get_template("applicant_term.jinja")
         self.major_index_template = env.get_template("major_index.jinja")
         self.program_index_template = env.get_template("program_index.jinja")
         self.area_index_template = env.get_template("area_index.jinja")
+        self.area_template = env.get_template("area.jinja")
+        self._memoize_fragments()
 
-    def build(self, all_applicants, all_datapoints, all_programs, all_majors):
-        self._preprocess(all_applicants, all_datapoints, all_programs, all_majors)
+    def build(self, all_applicants, all_datapoints, all_programs, all_majors, jobs=1):
+        with self.profiler.stage("preprocess"):
+            self._preprocess(all_applicants, all_datapoints, all_programs, all_majors)
 
         output_dir = Path(self.output_dir)
         output_dir.mkdir(exist_ok=True)
         mkdocs_docs_dir = output_dir / "docs"
         mkdocs_docs_dir.mkdir(exist_ok=True)
 
-        self._build_applicant_pages(
-            all_applicants, all_datapoints, all_programs, all_majors
-        )
-
-        self._build_major_pages(
-            all_applicants, all_datapoints, all_programs, all_majors
-        )
-
-        self._build_program_pages(
-            all_applicants, all_datapoints, all_programs, all_majors
+        self._build_row_pages(
+            (all_applicants, all_datapoints, all_programs, all_majors), jobs
         )
 
-        self._build_index_pages(
-            all_applicants,
-            all_datapoints,
-            all_programs,
-            all_majors,
-        )
+        with self.profiler.stage("render index pages"):
+            self._build_index_pages(
+                all_applicants,
+                all_datapoints,
+                all_programs,
+                all_majors,
+            )
 
-    def _build_applicant_pages(
-        self, all_applicants, all_datapoints, all_programs, all_majors
-    ):
-        for applicant in all_applicants.values():
-            applicant_md = self.applicant_template.render(
-                metadata={},
-                applicant=applicant,
-                majors=all_majors,
-                programs=all_programs,
-                datapoints=all_datapoints,
+        with self.profiler.stage("build search index") as stage:
+            stage["items"] = self._build_search_index(
+                self.mkdocs_docs_dir / "search-index",
+                all_applicants,
+                all_programs,
+                all_majors,
             )
 
-            output_path = self.mkdocs_docs_dir / "applicant" / f"{applicant['ID']}.md"
-            output_path.parent.mkdir(exist_ok=True)
-            with open(output_path, "w") as f:
-                f.write(applicant_md)
+    def _page_path(self, family: str, row: dict) -> Path:
+        return self.mkdocs_docs_dir / family / f"{row['ID']}.md"
 
-    def _build_major_pages(
-        self, all_applicants, all_datapoints, all_programs, all_majors
+    def _build_applicant_page(
+        self, applicant, all_applicants, all_datapoints, all_programs, all_majors
     ):
-        for major in all_majors.values():
-            major_md = self.major_template.render(
-                metadata={},
-                major=major,
-                applicants=all_applicants,
-                programs=all_programs,
-                datapoints=all_datapoints,
-            )
-
-            output_path = self.mkdocs_docs_dir / "major" / f"{major['ID']}.md"
-            output_path.parent.mkdir(exist_ok=True)
-            with open(output_path, "w") as f:
-                f.write(major_md)
+        self.output.render(
+            self._page_path("applicant", applicant),
+            self.applicant_template,
+            metadata={},
+            applicant=applicant,
+            majors=all_majors,
+            programs=all_programs,
+            datapoints=all_datapoints,
+        )
 
-    def _build_program_pages(
-        self, all_applicants, all_datapoints, all_programs, all_majors
+    def _build_major_page(
+        self, major, all_applicants, all_datapoints, all_programs, all_majors
     ):
-        for program in all_programs.values():
-            # do this work outside of jinja2 -- it's too complicated
-            program_datapoints = all_datapoints.copy()
-            program_datapoints = [
-                datapoint
-                for datapoint in all_datapoints.values()
-                if datapoint["项目"][0]["row_id"] == program["_id"]
-            ]
-            for datapoint in program_datapoints:
-                datapoint["申请人"] = datapoint["申请人"][0]["row_id"]
-
-            program_md = self.program_template.render(
-                metadata={},
-                program=program,
-                majors=all_majors,
-                applicants=all_applicants,
-                program_datapoints=program_datapoints,
-            )
+        self.output.render(
+            self._page_path("major", major),
+            self.major_template,
+            metadata={},
+            major=major,
+            applicants=all_applicants,
+            programs=all_programs,
+            datapoints=all_datapoints,
+        )
 
-            output_path = self.mkdocs_docs_dir / "program" / f"{program['ID']}.md"
-            output_path.parent.mkdir(exist_ok=True)
-            with open(output_path, "w") as f:
-                f.write(program_md)
+    def _build_program_page(
+        self, program, all_applicants, all_datapoints, all_programs, all_majors
+    ):
+        self.output.render(
+            self._page_path("program", program),
+            self.program_template,
+            metadata={},
+            program=program,
+            majors=all_majors,
+            applicants=all_applicants,
+            program_datapoints=self.program_datapoints[program["_id"]],
+            applicant_datapoints=self.program_applicant_datapoints[program["_id"]],
+        )
 
     def _build_index_pages(
         self, all_applicants, all_datapoints, all_programs, all_majors
@@ -144,61 +151,72 @@ class MkDocsFrontend(Frontend):
             reverse=True,
         )
 
-        mkdocs_config = self.mkdocs_template.render(
+        area_shards = self._get_area_shards()
+
+        self.output.render(
+            self.output_dir / "mkdocs.yml",
+            self.mkdocs_template,
             all_applicants=all_applicants,
             all_majors=all_majors,
             all_programs=all_programs,
             applicants_by_term=self.applicants_by_term,
+            area_shards=area_shards,
             majors=sorted_majors,
             programs=sorted_programs,
             build_time=datetime.now(tz=timezone(timedelta(hours=+8))).strftime(
                 "%Y年%-m月%-d日 %H:%M"
             ),
         )
-        with open(self.output_dir / "mkdocs.yml", "w") as f:
-            f.write(mkdocs_config)
 
-        index_md = self.index_template.render(
+        self.output.render(
+            self.mkdocs_docs_dir / "index.md",
+            self.index_template,
             applicant_num=len(all_applicants),
             major_num=len(all_majors),
             program_num=len(all_programs),
             area_num=len(self.all_areas),
         )
-        with open(self.mkdocs_docs_dir / "index.md", "w") as f:
-            f.write(index_md)
 
-        applicant_index_md = self.applicant_index_template.render(
+        # a landing page listing the terms, and a page for each term
+        self.output.render(
+            self.mkdocs_docs_dir / "applicant" / "index.md",
+            self.applicant_index_template,
             applicants_by_term=self.applicants_by_term,
+        )
+        self._render_term_shards(
+            lambda key: self.mkdocs_docs_dir / "applicant" / key / "index.md",
+            self.applicant_term_template,
             applicants=all_applicants,
             majors=all_majors,
             programs=all_programs,
-            datapoints=all_datapoints,
         )
-        with open(self.mkdocs_docs_dir / "applicant" / "index.md", "w") as f:
-            f.write(applicant_index_md)
 
-        major_index_md = self.major_index_template.render(
+        self.output.render(
+            self.mkdocs_docs_dir / "major" / "index.md",
+            self.major_index_template,
             majors=sorted_majors,
         )
-        with open(self.mkdocs_docs_dir / "major" / "index.md", "w") as f:
-            f.write(major_index_md)
 
-        program_index_md = self.program_index_template.render(
+        self.output.render(
+            self.mkdocs_docs_dir / "program" / "index.md",
+            self.program_index_template,
             programs=sorted_programs,
         )
-        with open(self.mkdocs_docs_dir / "program" / "index.md", "w") as f:
-            f.write(program_index_md)
 
-        # area index page
-        area_index_md = self.area_index_template.render(
+        # a landing page listing the areas, and a page for each area
+        self.output.render(
+            self.mkdocs_docs_dir / "area" / "index.md",
+            self.area_index_template,
             all_areas=self.all_areas,
+            area_shards=area_shards,
+        )
+        self._render_area_shards(
+            lambda slug: self.mkdocs_docs_dir / "area" / f"{slug}.md",
+            self.area_template,
             applicants=all_applicants,
             majors=all_majors,
             programs=all_programs,
-            datapoints=all_datapoints,
         )
-        with open(self.mkdocs_docs_dir / "area.md", "w") as f:
-            f.write(area_index_md)
 
     def copy_images(self, image_dir: Path):
-        shutil.copytree(image_dir, self.mkdocs_docs_dir / "images", dirs_exist_ok=True)
+        self.output.copy_tree(image_dir, self.mkdocs_docs_dir / "images")
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from jinja2 import Template
+
+# characters of a rendered page held in memory before it is written to disk
+BUFFER_SIZE = 256 * 1024
+
+
+class OutputWriter:
+    """
+    Writes the files of a build under `root`, skipping files whose content is
+    unchanged since the last build.
+
+    The SHA-256 digest of every file written is kept in a manifest persisted
+    between builds. Files recorded in the previous manifest but not written in
+    this build belong to rows that no longer exist, and are removed by `finish`.
+
+    The manifest also keeps a fingerprint of the inputs of each page, so that a
+    page whose inputs did not change is not rendered again (see `up_to_date`).
+    """
+
+    def __init__(self, root: Path, manifest_path: Path):
+        self.root = Path(root)
+        self.manifest_path = manifest_path
+        try:
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+            self.previous: dict[str, str] = manifest["files"]
+            self.previous_inputs: dict[str, str] = manifest["inputs"]
+        except (OSError, ValueError, KeyError, TypeError):
+            self.previous = {}
+            self.previous_inputs = {}
+        # path -> digest of files written in this build, and their status
+        self.current: dict[str, str] = {}
+        self.statuses: dict[str, str] = {}
+        # path -> fingerprint of the inputs of pages in this build
+        self.inputs: dict[str, str] = {}
+
+    def write(self, path: Path, content: str):
+        self.write_bytes(path, content.encode())
+
+    def render(self, path: Path, template: Template, **context):
+        """
+        Render `template` with `context` to `path`, streaming the chunks
+        generated by Jinja. Chunks are buffered up to `BUFFER_SIZE`; larger
+        pages spill to a temporary file next to `path` as they are generated,
+        so that they are never held whole in memory, and replace `path` only if
+        their digest changed.
+        """
+        chunks, size = [], 0
+        digest, temp_file = hashlib.sha256(), None
+        path = Path(path)
+        temp_path = path.with_name(f".{path.name}.tmp")
+        try:
+            for chunk in template.generate(**context):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size < BUFFER_SIZE:
+                    continue
+                if temp_file is None:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    temp_file = open(temp_path, "wb")
+                data = "".join(chunks).encode()
+                digest.update(data)
+                temp_file.write(data)
+                chunks, size = [], 0
+
+            if temp_file is None:
+                # small enough to be written at once
+                self.write(path, "".join(chunks))
+                return
+
+            data = "".join(chunks).encode()
+            digest.update(data)
+            temp_file.write(data)
+            temp_file.close()
+            if self._is_unchanged(path, digest.hexdigest()):
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, path)
+        except BaseException:
+            if temp_file is not None:
+                temp_file.close()
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            raise
+
+    def write_bytes(self, path: Path, data: bytes):
+        digest = hashlib.sha256(data).hexdigest()
+        if self._is_unchanged(path, digest):
+            return
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def copy_file(self, src: Path, dest: Path):
+        with open(src, "rb") as f:
+            self.write_bytes(dest, f.read())
+
+    def copy_tree(self, src: Path, dest: Path):
+        for dir_path, _, file_names in os.walk(src):
+            for file_name in sorted(file_names):
+                file_path = Path(dir_path) / file_name
+                self.copy_file(file_path, dest / file_path.relative_to(src))
+
+    def up_to_date(self, path: Path, fingerprint: str) -> bool:
+        """
+        Check whether the page at `path` was built from inputs with the same
+        `fingerprint` by the previous build, and if so keep it as is. Otherwise
+        the page must be written in this build.
+        """
+        key = self._key(path)
+        self.inputs[key] = fingerprint
+        if (
+            self.previous_inputs.get(key) == fingerprint
+            and key in self.previous
+            and os.path.isfile(path)
+        ):
+            self.current[key] = self.previous[key]
+            self.statuses[key] = "unchanged"
+            return True
+        return False
+
+    def keep(self, path: Path):
+        """
+        Keep a path created outside of the writer (e.g. a symlink) from being
+        removed as stale.
+        """
+        key = self._key(path)
+        self.statuses[key] = "kept"
+
+    def _is_unchanged(self, path: Path, digest: str) -> bool:
+        key = self._key(path)
+        self.current[key] = digest
+        if self.previous.get(key) == digest and os.path.isfile(path):
+            self.statuses[key] = "unchanged"
+            return True
+        self.statuses[key] = "changed" if key in self.previous else "added"
+        return False
+
+    def _key(self, path: Path) -> str:
+        return Path(path).relative_to(self.root).as_posix()
+
+    def take_records(self) -> tuple[dict, dict]:
+        """
+        Take the files written so far, to be merged into the writer of another
+        process with `merge_records`.
+        """
+        records = (self.current, self.statuses)
+        self.current = {}
+        self.statuses = {}
+        return records
+
+    def merge_records(self, records: tuple[dict, dict]):
+        self.current.update(records[0])
+        self.statuses.update(records[1])
+
+    def finish(self) -> dict[str, int]:
+        """
+        Remove stale files (and the directories they leave empty), save the
+        manifest, and return the number of files
+        added, changed, unchanged and removed.
+        """
+        counts = {"added": 0, "changed": 0, "unchanged": 0, "removed": 0}
+        for status in self.statuses.values():
+            if status in counts:
+                counts[status] += 1
+
+        for key in self.previous.keys() - self.statuses.keys():
+            path = self.root / key
+            # never remove files through a symlink into the resources
+            if self._under_symlink(path) or not os.path.isfile(path):
+                continue
+            os.remove(path)
+            self._remove_empty_dirs(path.parent)
+            counts["removed"] += 1
+
+        with open(self.manifest_path, "w") as f:
+            json.dump(
+                {"files": self.current, "inputs": self.inputs},
+                f,
+                ensure_ascii=False,
+                indent=0,
+                sort_keys=True,
+            )
+
+        return counts
+
+    def _remove_empty_dirs(self, path: Path):
+        # e.g. `applicant/<ID>/` of the HTML frontend, up to the root
+        while path != self.root and self.root in path.parents:
+            try:
+                os.rmdir(path)
+            except OSError:
+                # not empty
+                return
+            path = path.parent
+
+    def _under_symlink(self, path: Path) -> bool:
+        while path != self.root and path != path.parent:
+            if os.path.islink(path):
+                return True
+            path = path.parent
+        return False
@@ -0,0 +1,148 @@
+import json
+
+from ..backend import models
+
+# version of the format of the index, checked by `search.js`
+SEARCH_VERSION = 1
+# lower bounds of the GPA facet buckets, below the first is a bucket too
+GPA_BUCKETS = (3.0, 3.3, 3.5, 3.7, 3.8, 3.9)
+
+
+def build_index(
+    records: models.Records,
+    applicants_by_term: list[tuple[tuple, list]],
+    all_areas: dict,
+    all_applicants: dict,
+    all_programs: dict,
+    all_majors: dict,
+) -> dict[str, dict]:
+    """
+    Build the client-side search index of the site, as a dict of shard file
+    names to their content:
+
+    - `index.json`: the shards, with the number of entries of each, and the
+      facets (the applicants of each term, GPA bucket and area, and the
+      programs of each category)
+    - `applicant-<year>-<semester>.json`: the applicants of a term, so that a
+      search restricted to some terms only loads their shards; applicants
+      without a term are in `applicant-none.json`
+    - `program.json`, `major.json` and `area.json`
+
+    Entries are keyed on the `ID` of the rows (as in page URLs), and every shard
+    is in a stable order, so that an unchanged slice of the data gives the same
+    file and is not written again.
+    """
+    program_codes = {id: program.code for id, program in records.programs.items()}
+
+    def get_applicant(id: str) -> dict:
+        applicant = records.applicants[id]
+        row = all_applicants[id]
+        entry = {
+            "id": applicant.code,
+            "name": row.get("姓名/昵称") or applicant.code,
+            "major": applicant.major.code,
+            "gpa": applicant.gpa,
+            "areas": list(applicant.areas),
+            "programs": [
+                [program_codes[datapoint.program.id], datapoint.result]
+                for datapoint in applicant.datapoints
+            ],
+        }
+        if applicant.destination is not None:
+            entry["destination"] = applicant.destination.code
+        return entry
+
+    shards = {}
+    applicant_shards = []
+    termed = set()
+    for (year, semester), ids in applicants_by_term:
+        name = f"applicant-{year}-{semester}.json"
+        shards[name] = {"applicants": [get_applicant(id) for id in ids]}
+        applicant_shards.append([name, [year, semester], len(ids)])
+        termed.update(ids)
+    untermed = [id for id in records.applicants if id not in termed]
+    if untermed:
+        shards["applicant-none.json"] = {
+            "applicants": [get_applicant(id) for id in untermed]
+        }
+        applicant_shards.append(["applicant-none.json", None, len(untermed)])
+
+    shards["program.json"] = {
+        "programs": [
+            {
+                "id": program.code,
+                "school": program.school,
+                "name": program.name,
+                "category": program.category,
+                "results": all_programs[id]["__stats"]["results"]["counts"],
+            }
+            for id, program in records.programs.items()
+        ]
+    }
+    shards["major.json"] = {
+        "majors": [
+            {
+                "id": major.code,
+                "department": major.department,
+                "name": major.name,
+                "applicants": len(major.applicants),
+                "gpa": all_majors[id]["__gpa_median"],
+            }
+            for id, major in records.majors.items()
+        ]
+    }
+    shards["area.json"] = {
+        "areas": [
+            {
+                "name": area,
+                "applicants": [records.applicants[id].code for _, id in applicants],
+            }
+            for area, applicants in all_areas.items()
+        ]
+    }
+
+    shards["index.json"] = {
+        "version": SEARCH_VERSION,
+        "shards": {
+            "applicant": applicant_shards,
+            "program": "program.json",
+            "major": "major.json",
+            "area": "area.json",
+        },
+        "facets": _get_facets(records, all_areas, applicants_by_term),
+    }
+    return shards
+
+
+def dumps(shard: dict) -> str:
+    # compact, the index is only read by scripts
+    return json.dumps(shard, ensure_ascii=False, separators=(",", ":"))
+
+
+def _get_facets(
+    records: models.Records, all_areas: dict, applicants_by_term: list
+) -> dict:
+    gpa_counts = [0] * (len(GPA_BUCKETS) + 1)
+    for applicant in records.applicants.values():
+        if isinstance(applicant.gpa, (int, float)):
+            gpa_counts[sum(applicant.gpa >= bound for bound in GPA_BUCKETS)] += 1
+    bounds = (None,) + GPA_BUCKETS + (None,)
+
+    categories: dict[str, int] = {}
+    for program in records.programs.values():
+        if program.category is not None:
+            categories[program.category] = categories.get(program.category, 0) + 1
+
+    return {
+        "terms": [
+            [year, semester, len(ids)] for (year, semester), ids in applicants_by_term
+        ],
+        "gpa": [
+            [bounds[i], bounds[i + 1], count] for i, count in enumerate(gpa_counts)
+        ],
+        "areas": [
+            [area, len({id for _, id in applicants})]
+            for area, applicants in all_areas.items()
+        ],
+        "categories": sorted(categories.items()),
+    }
@@ -0,0 +1,149 @@
+import contextlib
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+class Profiler:
+    """
+    Records the wall time and the peak memory of the stages of a build, and
+    counters such as the HTTP requests made.
+
+    Stages may run concurrently (e.g. tables fetched in parallel) or nested,
+    and are recorded in the order they finish. Each stage records the resident
+    set size of the process when it starts, and its peak during the stage: on
+    Linux the high-water mark of the process is reset when a stage starts, and
+    read (for every running stage) whenever a stage starts or ends. Children
+    that finished during the stage (e.g. the workers of `--jobs`) count with
+    their own peak. Elsewhere, the peak is the peak of the process so far.
+
+    A disabled profiler records nothing, so code can be instrumented
+    unconditionally.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.stages: list[dict] = []
+        self.counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+        # records of the running stages -> their peak RSS so far, in KiB
+        self._running: dict[int, float] = {}
+        # peak RSS of the process over the high-water marks reset, in KiB
+        self._peak = 0
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Time the stage `name` run in the `with` block. The block may set
+        `items` in the yielded record to the number of items (e.g. pages) the
+        stage processed, to report its rate.
+        """
+        record = {"name": name}
+        if not self.enabled:
+            yield record
+            return
+
+        with self._lock:
+            self._update_peaks()
+            rss = _read_memory_status().get("VmRSS")
+            if rss is not None and _reset_peak():
+                self._running[id(record)] = rss
+            else:
+                self._running[id(record)] = _peak_rss()
+            children_peak = _peak_rss(resource.RUSAGE_CHILDREN) if resource else 0
+        if rss is not None:
+            record["start_rss_mb"] = round(rss / 2**10, 1)
+
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            record["seconds"] = round(seconds, 4)
+            with self._lock:
+                self._update_peaks()
+                peak = self._running.pop(id(record))
+                if resource is not None:
+                    # only children that finished during the stage raise it
+                    children = _peak_rss(resource.RUSAGE_CHILDREN)
+                    if children > children_peak:
+                        peak = max(peak, children)
+                record["peak_rss_mb"] = round(peak / 2**10, 1)
+                if "items" in record and seconds > 0:
+                    record["items_per_second"] = round(record["items"] / seconds, 1)
+                self.stages.append(record)
+
+    def _update_peaks(self):
+        # before the high-water mark is reset by a stage starting, and when a
+        # stage ends; under `_lock`
+        peak = _read_memory_status().get("VmHWM")
+        if peak is None:
+            peak = _peak_rss()
+        self._peak = max(self._peak, peak)
+        for key, value in self._running.items():
+            self._running[key] = max(value, peak)
+
+    def count(self, name: str, value: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self) -> dict:
+        with self._lock:
+            self._update_peaks()
+            return {
+                "stages": list(self.stages),
+                "counters": dict(self.counters),
+                # getrusage only knows the peak since the last reset
+                "peak_rss_mb": round(max(self._peak, _peak_rss()) / 2**10, 1),
+            }
+
+
+def _peak_rss(who=None) -> float:
+    """
+    Peak resident set size of the process (or its children) since it started,
+    in KiB.
+    """
+    if resource is None:
+        return 0
+    if who is None:
+        return max(_peak_rss(resource.RUSAGE_SELF), _peak_rss(resource.RUSAGE_CHILDREN))
+    peak = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**10 if sys.platform == "darwin" else peak
+
+
+def _read_memory_status() -> dict[str, int]:
+    # the current (VmRSS) and peak (VmHWM) resident set size in KiB, on Linux
+    try:
+        with open("/proc/self/status", "r") as f:
+            lines = f.readlines()
+    except OSError:
+        return {}
+    status = {}
+    for line in lines:
+        key, _, value = line.partition(":")
+        if key in ("VmRSS", "VmHWM"):
+            status[key] = int(value.split()[0])
+    return status
+
+
+def _reset_peak() -> bool:
+    # reset VmHWM to the current RSS, if the kernel allows it
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+# shared by code not given a profiler
+disabled = Profiler(enabled=False)
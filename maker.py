@@ -1,20 +1,28 @@
 import argparse
+import collections
 import json
 import os
-import shutil
+import sqlite3
+from datetime import datetime, timezone
 from pathlib import Path
 
 import feiyue.backend as backend
+from feiyue.backend.dtable import DtableArchive
+from feiyue.backend.images import ImageCache
+from feiyue.backend.store import RowStore
 from feiyue.frontend.mkdocs import MkDocsFrontend
 from feiyue.frontend.latex import LatexFrontend
+from feiyue.frontend.html import HtmlFrontend
+from feiyue.profiler import Profiler
 
 file_path = Path(os.path.dirname(os.path.realpath(__file__)))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--api-key", type=str, default=None)
-    parser.add_argument("--api-base", type=str, default="https://cloud.seatable.io")
+    parser.add_argument("--api-base", type=str, default=backend.api.DEFAULT_API_BASE)
     parser.add_argument("--output-dir", type=str, default="output")
+    parser.add_argument("--cache-dir", type=str, default=".cache")
     parser.add_argument(
         "--link-resources",
         action="store_true",
@@ -25,68 +33,177 @@ if __name__ == "__main__":
         action="store_true",
         help="use data cached on device without querying the API",
     )
-    parser.add_argument("--frontend", type=str, required=True, help="mkdocs or latex")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="update data cached on device with rows modified since the last sync",
+    )
+    parser.add_argument(
+        "--dtable",
+        type=str,
+        default=None,
+        help="read rows and images from a .dtable export instead of the API",
+    )
+    parser.add_argument(
+        "--frontend", type=str, required=True, help="mkdocs, latex or html"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of concurrent API requests when fetching rows and images",
+    )
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=backend.api.BATCH_SIZE,
+        help="number of rows requested per API page",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=30, help="timeout of each API request"
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=5,
+        help="times to retry an API request failing with a transient error",
+    )
+    parser.add_argument(
+        "--backoff",
+        type=float,
+        default=0.5,
+        help="backoff factor between retries, in seconds",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of processes rendering pages",
+    )
+    parser.add_argument(
+        "--invalid-report",
+        type=str,
+        default=None,
+        help="write the dropped invalid rows and the reasons to this JSON file",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        nargs="?",
+        const="profile.json",
+        default=None,
+        help="write the time and memory of each stage and the requests made "
+        "to this JSON file (profile.json by default)",
+    )
     args = parser.parse_args()
 
+    profiler = Profiler(enabled=args.profile is not None)
+
     api_key = args.api_key
-    backend.api.api_base = args.api_base
+    client = None
+    if api_key is not None:
+        client = backend.api.SeaTableClient(
+            api_key,
+            args.api_base,
+            timeout=args.timeout,
+            retries=args.retries,
+            backoff=args.backoff,
+            pool_size=max(args.workers, 1),
+            profiler=profiler,
+        )
 
     cache_loaded = False
-    cache_dir = file_path / ".cache"
-
-    if args.cached:
-
-        def load_cache(file_name: Path):
-            with open(cache_dir / file_name, "r") as f:
-                return json.load(f)
-
-        # check if is cached already
-        if os.path.isdir(cache_dir):
-            print("Loading rows from cache...")
-            try:
-                all_applicants = load_cache("applicants.json")
-                all_datapoints = load_cache("datapoints.json")
-                all_programs = load_cache("programs.json")
-                all_majors = load_cache("majors.json")
+    cache_dir = file_path / args.cache_dir
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # rows, images and compiled templates are local to this machine, keep them
+    # out of git wherever --cache-dir points
+    if not (cache_dir / ".gitignore").exists():
+        with open(cache_dir / ".gitignore", "w") as f:
+            f.write("*\n")
+    store_path = cache_dir / "rows.sqlite3"
+
+    archive = None
+    store = None
+    if args.dtable is not None:
+        # a snapshot of the base, kept apart from the cached rows of the live base
+        archive = DtableArchive(Path(args.dtable))
+        print("Loading rows from archive...")
+        with profiler.stage("load rows"):
+            cached_rows = dict(
+                zip(["申请人", "数据点", "项目", "本科专业"], archive.get_all_rows())
+            )
+    else:
+        try:
+            store = RowStore(store_path)
+        except sqlite3.DatabaseError:
+            # only the rows are lost, the rest of the cache (e.g. images) is kept
+            print("Row store is corrupt, recreating it")
+            os.remove(store_path)
+            store = RowStore(store_path)
+
+        if args.cached or args.incremental:
+            if store.has_rows():
+                print("Loading rows from cache...")
+                with profiler.stage("load rows"):
+                    cached_rows = store.load()
                 cache_loaded = True
-            except:
-                shutil.rmtree(file_path / ".cache")
-
-    if not cache_loaded:
-        if api_key is None:
-            raise Exception("API key is not provided")
-        print("Getting all rows...")
-        all_applicants, all_datapoints, all_programs, all_majors = backend.get_all_rows(
-            api_key
-        )
 
-        # create cache
-        cache_dir.mkdir(exist_ok=True)
-        with open(cache_dir / "applicants.json", "w") as f:
-            json.dump(all_applicants, f, ensure_ascii=False)
-        with open(cache_dir / "datapoints.json", "w") as f:
-            json.dump(all_datapoints, f, ensure_ascii=False)
-        with open(cache_dir / "programs.json", "w") as f:
-            json.dump(all_programs, f, ensure_ascii=False)
-        with open(cache_dir / "majors.json", "w") as f:
-            json.dump(all_majors, f, ensure_ascii=False)
+        if args.incremental or not cache_loaded:
+            if api_key is None:
+                raise Exception("API key is not provided")
 
-    # download uploaded images from seatable
-    if api_key is not None:
-        image_cache_dir = cache_dir / "images"
-        image_cache_dir.mkdir(exist_ok=True)
-        print("Downloading images...")
+            if args.incremental and cache_loaded:
+                print("Syncing modified rows...")
+                cached_rows, watermarks, counts = backend.sync_all_rows(
+                    client,
+                    cached_rows,
+                    store.get_watermarks(),
+                    workers=args.workers,
+                    page_size=args.page_size,
+                )
+                for table, (fetched, deleted) in counts.items():
+                    print(f"  {table}: {fetched} fetched, {deleted} deleted")
+            else:
+                print("Getting all rows...")
+                all_rows = backend.get_all_rows(
+                    client, workers=args.workers, page_size=args.page_size
+                )
+                cached_rows = dict(
+                    zip(["申请人", "数据点", "项目", "本科专业"], all_rows)
+                )
+                watermarks = backend.get_watermarks(cached_rows)
+
+            # update cache
+            with profiler.stage("save rows"):
+                store.save(cached_rows, watermarks)
 
+    all_applicants = cached_rows["申请人"]
+    all_datapoints = cached_rows["数据点"]
+    all_programs = cached_rows["项目"]
+    all_majors = cached_rows["本科专业"]
+
+    # download uploaded images from seatable
+    image_cache_dir = cache_dir / "images"
+    if archive is not None or client is not None:
         # TODO: more flexible path
         paths = backend.update_image_path(all_applicants, "../images")
-        for file_name, url_path in paths:
-            path = image_cache_dir / file_name
-            if path.exists():
-                continue
-            # download
-            data = backend.download_image(url_path, api_key)
-            with open(image_cache_dir / file_name, "wb") as f:
-                f.write(data)
+        image_cache = ImageCache(image_cache_dir, cache_dir / "images.json")
+        if archive is not None:
+            print("Extracting images...")
+            with profiler.stage("images") as stage:
+                extracted = archive.extract_images(image_cache, paths)
+                stage["items"] = extracted
+            archive.close()
+            print(f"  {extracted} of {len(set(paths))} images extracted")
+        else:
+            print("Downloading images...")
+            with profiler.stage("images") as stage:
+                downloaded = image_cache.download_all(
+                    client, paths, workers=args.workers
+                )
+                stage["items"] = downloaded
+            print(f"  {downloaded} of {len(set(paths))} images downloaded")
+    image_cache_dir.mkdir(parents=True, exist_ok=True)
 
     print(
         "Done, got",
@@ -101,11 +218,23 @@ if __name__ == "__main__":
     )
 
     # filter out invalid datapoints
-    backend.filter_out_invalid(all_applicants, all_datapoints, all_programs, all_majors)
+    with profiler.stage("filter"):
+        invalid_rows = backend.filter_out_invalid(
+            all_applicants, all_datapoints, all_programs, all_majors
+        )
+    print(f"Dropped {len(invalid_rows)} invalid rows")
+    for (table, reason), count in collections.Counter(
+        (row["table"], row["reason"]) for row in invalid_rows
+    ).items():
+        print(f"  {table}: {count} {reason}")
+    if args.invalid_report is not None:
+        with open(args.invalid_report, "w") as f:
+            json.dump(invalid_rows, f, ensure_ascii=False, indent=2)
 
     # get the terms that each applicant applied for & update nickname
-    backend.set_term(all_applicants, all_datapoints, key="__term")
-    backend.update_nickname(all_applicants)
+    with profiler.stage("set term"):
+        backend.set_term(all_applicants, all_datapoints, key="__term")
+        backend.update_nickname(all_applicants)
 
     # build
     if args.frontend == "mkdocs":
@@ -113,17 +242,74 @@ if __name__ == "__main__":
             file_path / args.output_dir,
             file_path / "templates" / "mkdocs",
             file_path / "resources" / "mkdocs",
+            profiler=profiler,
+            template_cache_dir=cache_dir / "templates" / args.frontend,
+            stats_store=store,
         )
     elif args.frontend == "latex":
         frontend = LatexFrontend(
             file_path / args.output_dir,
             file_path / "templates" / "latex",
             file_path / "resources" / "latex",
+            profiler=profiler,
+            template_cache_dir=cache_dir / "templates" / args.frontend,
+            stats_store=store,
+        )
+    elif args.frontend == "html":
+        frontend = HtmlFrontend(
+            file_path / args.output_dir,
+            file_path / "templates" / "html",
+            file_path / "resources" / "html",
+            profiler=profiler,
+            template_cache_dir=cache_dir / "templates" / args.frontend,
+            stats_store=store,
         )
     else:
         raise Exception(f"Invalid frontend {args.frontend}")
 
-    frontend.pre_build()
-    frontend.build(all_applicants, all_datapoints, all_programs, all_majors)
-    frontend.copy_resources(args.link_resources)
-    frontend.copy_images(image_cache_dir)
+    with profiler.stage("compile templates"):
+        frontend.pre_build()
+    frontend.build(
+        all_applicants, all_datapoints, all_programs, all_majors, jobs=args.jobs
+    )
+    with profiler.stage("copy resources"):
+        frontend.copy_resources(args.link_resources)
+    with profiler.stage("copy images"):
+        frontend.copy_images(image_cache_dir)
+    with profiler.stage("finish output"):
+        counts = frontend.finish()
+    if store is not None:
+        store.close()
+    print(
+        "Output:",
+        ", ".join(f"{count} {status}" for status, count in counts.items()),
+    )
+
+    if args.profile is not None:
+        report = profiler.report()
+        report["date"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        report["args"] = {
+            key: value for key, value in vars(args).items() if key != "api_key"
+        }
+        report["rows"] = {
+            "applicants": len(all_applicants),
+            "datapoints": len(all_datapoints),
+            "programs": len(all_programs),
+            "majors": len(all_majors),
+        }
+        report["output"] = counts
+        with open(args.profile, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        print("Profile:")
+        for stage in report["stages"]:
+            line = f"  {stage['name']:<28}{stage['seconds']:>9.3f} s"
+            # RSS at the start of the stage, then its peak during the stage
+            if "start_rss_mb" in stage:
+                line += f"{stage['start_rss_mb']:>9.1f} ->"
+            line += f"{stage['peak_rss_mb']:>9.1f} MiB"
+            if "items_per_second" in stage:
+                line += f"  {stage['items']} at {stage['items_per_second']}/s"
+            print(line)
+        for name, value in report["counters"].items():
+            print(f"  {name}: {value}")
@@ -0,0 +1,135 @@
+// Search of applicants on the finder page, over the index generated in
+// docs/search-index/ by the MkDocs frontend. Applicants are sharded by term, so
+// only the shards of the terms searched are fetched.
+(function () {
+    const SEARCH_VERSION = 1;
+    const MAX_RESULTS = 200;
+    const script = document.currentScript;
+    const base = new URL("../", script.src);
+    const shards = {};
+
+    function fetchShard(name) {
+        if (!(name in shards)) {
+            shards[name] = fetch(new URL("search-index/" + name, base)).then(
+                (response) => response.json()
+            );
+        }
+        return shards[name];
+    }
+
+    function option(value, text) {
+        const element = document.createElement("option");
+        element.value = value;
+        element.textContent = text;
+        return element;
+    }
+
+    async function init(finder) {
+        const index = await fetchShard("index.json");
+        if (index.version !== SEARCH_VERSION) {
+            return;
+        }
+        const form = finder.querySelector("form");
+        for (const [name, term, count] of index.shards.applicant) {
+            const text = term ? `${term[0]} ${term[1]}` : "未知学期";
+            form.term.append(option(name, `${text} (${count})`));
+        }
+        index.facets.gpa.forEach(([lower, upper, count], i) => {
+            const text =
+                lower === null ? `< ${upper}` : upper === null ? `≥ ${lower}` : `${lower} – ${upper}`;
+            form.gpa.append(option(i, `${text} (${count})`));
+        });
+        for (const [area, count] of index.facets.areas) {
+            form.area.append(option(area, `${area} (${count})`));
+        }
+        form.addEventListener("input", () => search(index, form, finder));
+        form.addEventListener("submit", (event) => event.preventDefault());
+        search(index, form, finder);
+    }
+
+    async function search(index, form, finder) {
+        const names = form.term.value
+            ? [form.term.value]
+            : index.shards.applicant.map(([name]) => name);
+        const [programs, majors, ...terms] = await Promise.all(
+            [index.shards.program, index.shards.major, ...names].map(fetchShard)
+        );
+        const programById = new Map(programs.programs.map((p) => [p.id, p]));
+        const majorById = new Map(majors.majors.map((m) => [m.id, m]));
+        const gpa = form.gpa.value === "" ? null : index.facets.gpa[form.gpa.value];
+        const words = form.query.value.toLowerCase().split(/\s+/).filter(Boolean);
+
+        const seen = new Set();
+        const results = [];
+        for (const shard of terms) {
+            for (const applicant of shard.applicants) {
+                if (seen.has(applicant.id)) {
+                    continue;
+                }
+                seen.add(applicant.id);
+                if (form.area.value && !applicant.areas.includes(form.area.value)) {
+                    continue;
+                }
+                if (
+                    gpa !== null &&
+                    (typeof applicant.gpa !== "number" ||
+                        (gpa[0] !== null && applicant.gpa < gpa[0]) ||
+                        (gpa[1] !== null && applicant.gpa >= gpa[1]))
+                ) {
+                    continue;
+                }
+                const major = majorById.get(applicant.major);
+                const text = [
+                    applicant.name,
+                    major ? `${major.department} ${major.name}` : "",
+                    ...applicant.areas,
+                    ...applicant.programs.map(([id]) => {
+                        const program = programById.get(id);
+                        return program ? `${program.name} ${program.school}` : "";
+                    }),
+                ]
+                    .join(" ")
+                    .toLowerCase();
+                if (words.every((word) => text.includes(word))) {
+                    results.push([applicant, major]);
+                }
+            }
+        }
+        render(results, programById, finder);
+    }
+
+    function render(results, programById, finder) {
+        const list = finder.querySelector(".finder-results");
+        list.replaceChildren();
+        finder.querySelector(".finder-count").textContent = `共 ${results.length} 个申请人`;
+        for (const [applicant, major] of results.slice(0, MAX_RESULTS)) {
+            const item = document.createElement("li");
+            const link = document.createElement("a");
+            link.href = new URL(`applicant/${applicant.id}/`, base);
+            link.textContent = applicant.name;
+            item.append(link);
+            const details = [];
+            if (major) {
+                details.push(major.department);
+            }
+            if (typeof applicant.gpa === "number") {
+                details.push(`GPA ${applicant.gpa}`);
+            }
+            const destination = programById.get(applicant.destination);
+            if (destination) {
+                details.push(`${destination.name}@${destination.school}`);
+            }
+            const small = document.createElement("small");
+            small.textContent = " / " + details.join(" / ");
+            item.append(small);
+            list.append(item);
+        }
+    }
+
+    document.addEventListener("DOMContentLoaded", () => {
+        const finder = document.getElementById("finder");
+        if (finder) {
+            init(finder);
+        }
+    });
+})();
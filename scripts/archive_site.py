@@ -1,46 +1,255 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from lxml import etree
 import requests
+from requests.adapters import HTTPAdapter
 import argparse
+import json
+import os
+import threading
 import time
 
 WAYBACK_URL = "https://web.archive.org/save/"
 RETRIES = 5
 TIME_LIMIT = 6 * 60 * 59  # 6 hours
+# save the state every this many archived pages, besides when stopping
+SAVE_EVERY = 20
+
+
+class RateLimiter:
+    """
+    Token bucket shared by the workers, allowing `rate` requests per second.
+
+    The rate adapts to the server: it is halved on every 429 (down to
+    `min_rate`), and recovers additively on every success up to `rate`.
+    """
+
+    def __init__(self, rate: float, min_rate: float):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.allowance = 1.0
+        self.last = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.allowance = min(
+                    1.0, self.allowance + (now - self.last) * self.rate
+                )
+                self.last = now
+                if now >= self.paused_until and self.allowance >= 1:
+                    self.allowance -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.allowance) / self.rate)
+            time.sleep(wait)
+
+    def throttled(self, retry_after: float):
+        with self.lock:
+            self.rate = max(self.rate / 2, self.min_rate)
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.rate + self.min_rate / 10, self.max_rate)
+
+
+class ArchiveState:
+    """
+    Persistent record of the last time each page was archived, and of the
+    pages that failed, so that a later run resumes where this one stopped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.unsaved = 0
+        try:
+            with open(path, "r") as f:
+                self.pages: dict[str, dict] = json.load(f)
+        except (OSError, ValueError):
+            self.pages = {}
+
+    def archived_since(self, url: str, since: datetime) -> bool:
+        archived = self.pages.get(url, {}).get("archived")
+        return archived is not None and datetime.fromisoformat(archived) >= since
+
+    def record(self, url: str, archived: bool):
+        with self.lock:
+            page = self.pages.setdefault(url, {})
+            if archived:
+                page["archived"] = datetime.now(timezone.utc).isoformat(
+                    timespec="seconds"
+                )
+                page.pop("failures", None)
+            else:
+                page["failures"] = page.get("failures", 0) + 1
+            self.unsaved += 1
+            if self.unsaved >= SAVE_EVERY:
+                self._save()
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        # written aside and renamed, so that an interrupted run never leaves a
+        # truncated state
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.pages, f, indent=0, sort_keys=True)
+        os.replace(temp_path, self.path)
+        self.unsaved = 0
+
+
+def get_pages(sitemap_url: str) -> list[str]:
+    r = requests.get(sitemap_url)
+    r.raise_for_status()
+    sitemap_root = etree.fromstring(r.content)
+    return [sitemap.getchildren()[0].text for sitemap in sitemap_root]
+
+
+def read_changed_pages(path: str, pages: list[str]) -> set[str]:
+    """
+    Read the pages listed one per line in `path`, as full URLs or as paths
+    relative to the site (e.g. `applicant/42/`).
+    """
+    with open(path, "r") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    changed = set()
+    for line in lines:
+        suffix = line.split("://", 1)[-1].lstrip("/")
+        changed.update(
+            page
+            for page in pages
+            if page == line or page.rstrip("/").endswith("/" + suffix.rstrip("/"))
+        )
+    return changed
+
+
+def archive_page(
+    session: requests.Session, limiter: RateLimiter, page: str, deadline: float
+) -> bool:
+    for i in range(RETRIES + 1):
+        if time.monotonic() > deadline:
+            return False
+        limiter.acquire()
+        try:
+            r = session.get(WAYBACK_URL + page, timeout=120)
+        except requests.RequestException as e:
+            print(f"Failed to archive {page} ({e}), attempt {i + 1}/{RETRIES + 1}")
+            time.sleep(2**i)
+            continue
+
+        if r.status_code == 429:
+            retry_after = r.headers.get("Retry-After", "")
+            limiter.throttled(float(retry_after) if retry_after.isdigit() else 2**i)
+            print(f"Rate limited on {page}, slowing down to {limiter.rate:.3f}/s")
+            continue
+        if r.status_code >= 400:
+            print(
+                f"Failed to archive {page} (status {r.status_code}), "
+                f"attempt {i + 1}/{RETRIES + 1}"
+            )
+            time.sleep(2**i)
+            continue
+
+        limiter.succeeded()
+        return True
+    return False
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Archive a site")
-    parser.add_argument("site", type=str)
+    parser.add_argument("site", type=str, help="URL of the sitemap of the site")
     parser.add_argument("--start", type=int, default=0)
     parser.add_argument("--end", type=int, default=None)
+    parser.add_argument(
+        "--workers", type=int, default=4, help="number of concurrent requests"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0.2,
+        help="maximum save requests per second, halved on every 429",
+    )
+    parser.add_argument(
+        "--state",
+        type=str,
+        default="archive-state.json",
+        help="file recording the pages archived, to resume from",
+    )
+    parser.add_argument(
+        "--recent-days",
+        type=float,
+        default=7,
+        help="skip pages archived less than this many days ago",
+    )
+    parser.add_argument(
+        "--changed",
+        type=str,
+        default=None,
+        help="file listing the pages changed, one per line; only these and pages "
+        "never archived are archived",
+    )
+    parser.add_argument(
+        "--time-limit", type=float, default=TIME_LIMIT, help="in seconds"
+    )
     args = parser.parse_args()
 
-    start_time = time.time()
-
-    r = requests.get(args.site)
-    sitemap_root = etree.fromstring(r.content)
+    deadline = time.monotonic() + args.time_limit
+    state = ArchiveState(args.state)
 
-    sites = [sitemap.getchildren()[0].text for sitemap in sitemap_root]
-    sites = sites[args.start : args.end]
+    pages = get_pages(args.site)[args.start : args.end]
+    if args.changed is not None:
+        changed = read_changed_pages(args.changed, pages)
+        todo = [
+            page
+            for page in pages
+            if page in changed or not state.pages.get(page, {}).get("archived")
+        ]
+    else:
+        recent = datetime.now(timezone.utc) - timedelta(days=args.recent_days)
+        todo = [page for page in pages if not state.archived_since(page, recent)]
+    # pages never archived first, then the least recently archived
+    todo.sort(key=lambda page: state.pages.get(page, {}).get("archived", ""))
 
     print(
-        f"Archiving {len(sites)} sites of {args.site} (from {args.start} to {args.end})"
+        f"Archiving {len(todo)} of {len(pages)} pages of {args.site} "
+        f"(from {args.start} to {args.end}), {len(pages) - len(todo)} skipped"
     )
 
-    while len(sites) > 0:
-        if time.time() - start_time > TIME_LIMIT:
-            print(f"Time limit reached, skipping remaining {len(sites)} sites")
-            break
-        site = sites.pop(0)
-        for i in range(RETRIES + 1):
-            try:
-                r = requests.get(WAYBACK_URL + site)
-                r.raise_for_status()
-                print(f"Archived {site}")
-                break
-            except KeyboardInterrupt:
-                exit(0)
-            except BaseException as e:
-                print(f"Failed to archive {site}, retrying (attempt {i+1}/{RETRIES})")
-        else:
-            sites.append(site)
-            print(f"Failed to archive {site} after {RETRIES} attempts")
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=args.workers, pool_maxsize=args.workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    limiter = RateLimiter(args.rate, min_rate=args.rate / 16)
+
+    def archive(page: str) -> bool:
+        archived = archive_page(session, limiter, page, deadline)
+        if archived:
+            print(f"Archived {page}")
+        elif time.monotonic() <= deadline:
+            print(f"Failed to archive {page} after {RETRIES + 1} attempts")
+        if archived or time.monotonic() <= deadline:
+            state.record(page, archived)
+        return archived
+
+    executor = ThreadPoolExecutor(args.workers)
+    try:
+        results = list(executor.map(archive, todo))
+    except KeyboardInterrupt:
+        executor.shutdown(wait=False, cancel_futures=True)
+        state.save()
+        print(f"Interrupted, state saved to {args.state}")
+        exit(1)
+    executor.shutdown()
+    state.save()
+
+    archived = sum(results)
+    print(f"Archived {archived} pages, {len(todo) - archived} left for the next run")
+    if time.monotonic() > deadline:
+        print("Time limit reached")
@@ -0,0 +1,116 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(Path(os.path.dirname(os.path.realpath(__file__))).parent.as_posix())
+from seatable_stub import StubSeaTable, serve
+from synthetic_data import generate_rows
+
+root_path = Path(os.path.dirname(os.path.realpath(__file__))).parent
+
+# lines printed by maker.py when a stage starts
+STAGES = [
+    ("Loading rows from cache", "load rows"),
+    ("Getting all rows", "fetch rows"),
+    ("Syncing modified rows", "sync rows"),
+    ("Downloading images", "images"),
+    ("Done, got", "filter & preprocess"),
+    ("Rendering", "render"),
+    ("Output:", "finish"),
+]
+
+
+def run_maker(maker_args: list[str]) -> dict[str, float]:
+    """
+    Run maker.py, and return the wall time of each stage, from the times its
+    progress lines are printed.
+    """
+    start = time.perf_counter()
+    times = {}
+    stage, stage_start = "start", start
+    process = subprocess.Popen(
+        [sys.executable, "-u", root_path / "maker.py"] + maker_args,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    for line in process.stdout:
+        for prefix, name in STAGES:
+            if line.startswith(prefix):
+                now = time.perf_counter()
+                times[stage] = times.get(stage, 0) + now - stage_start
+                stage, stage_start = name, now
+    if process.wait() != 0:
+        raise Exception(f"maker.py failed with status {process.returncode}")
+    now = time.perf_counter()
+    times[stage] = times.get(stage, 0) + now - stage_start
+    times["total"] = now - start
+    return times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build end to end against a local SeaTable stand-in, "
+        "reporting the time of each stage and the requests made",
+        epilog="Arguments after -- are passed to maker.py, e.g. -- --workers=8",
+    )
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--invalid-ratio", type=float, default=0.02)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--rate-limit", type=float, default=None)
+    parser.add_argument("--failure-rate", type=float, default=0)
+    parser.add_argument("--frontend", type=str, default="mkdocs")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="build a second time with --incremental on the cache of the first",
+    )
+    args, maker_args = parser.parse_known_args()
+    if maker_args[:1] == ["--"]:
+        maker_args = maker_args[1:]
+
+    stub = StubSeaTable(
+        generate_rows(args.scale, args.seed, args.invalid_ratio),
+        latency=args.latency,
+        rate_limit=args.rate_limit,
+        failure_rate=args.failure_rate,
+        seed=args.seed,
+    )
+    server = serve(stub)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_dir = Path(temp_dir) / "output"
+        output_dir.mkdir()
+        base_args = [
+            "--api-key=stub",
+            f"--api-base=http://127.0.0.1:{server.server_address[1]}",
+            f"--frontend={args.frontend}",
+            f"--cache-dir={Path(temp_dir) / 'cache'}",
+            f"--output-dir={output_dir}",
+        ]
+
+        runs = [("full", [])]
+        if args.incremental:
+            runs.append(("incremental", ["--incremental"]))
+
+        for run, run_args in runs:
+            counts_before = dict(stub.counts)
+            times = run_maker(base_args + run_args + maker_args)
+            counts = {
+                endpoint: count - counts_before.get(endpoint, 0)
+                for endpoint, count in stub.counts.items()
+            }
+
+            print(f"{run} build")
+            for stage, seconds in times.items():
+                print(f"  {stage:<22}{seconds:>8.3f} s")
+            print(
+                "  requests: "
+                + ", ".join(f"{e} {c}" for e, c in sorted(counts.items()))
+            )
+
+    server.shutdown()
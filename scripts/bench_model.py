@@ -0,0 +1,92 @@
+import argparse
+import copy
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(Path(os.path.dirname(os.path.realpath(__file__))).parent.as_posix())
+from feiyue.backend import models
+from synthetic_data import generate
+
+
+def _allocated(build) -> tuple[object, int]:
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def _best_time(run, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def aggregate_rows(applicants: dict, datapoints: dict, majors: dict):
+    # the major statistics of `Frontend._preprocess`, on row dicts
+    for major in majors.values():
+        programs = {}
+        gpas = []
+        for applicant in major.get("申请人", []):
+            applicant = applicants[applicant["row_id"]]
+            for datapoint in applicant.get("数据点", []):
+                datapoint = datapoints[datapoint]
+                program = datapoint["项目"][0]["row_id"]
+                programs[program] = programs.get(program, 0) + 1
+            if applicant.get("GPA") is not None:
+                gpas.append(applicant["GPA"])
+        statistics.median(gpas) if gpas else None
+
+
+def aggregate_records(records: models.Records):
+    # the same statistics on records
+    for major in records.majors.values():
+        programs = {}
+        gpas = []
+        for applicant in major.applicants:
+            for datapoint in applicant.datapoints:
+                programs[datapoint.program.id] = (
+                    programs.get(datapoint.program.id, 0) + 1
+                )
+            if applicant.gpa is not None:
+                gpas.append(applicant.gpa)
+        statistics.median(gpas) if gpas else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare memory and aggregation time of row dicts and records"
+    )
+    parser.add_argument("--scales", type=float, nargs="+", default=[1, 10])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{'scale':>8} {'rows MiB':>10} {'records MiB':>12} "
+        f"{'adapt s':>9} {'rows s':>9} {'records s':>10}"
+    )
+    for scale in args.scales:
+        tables = generate(scale)
+        applicants, datapoints, programs, majors = tables
+
+        _, rows_size = _allocated(lambda: copy.deepcopy(tables))
+        records, records_size = _allocated(lambda: models.from_rows(*tables))
+
+        adapt_time = _best_time(lambda: models.from_rows(*tables), args.repeat)
+        rows_time = _best_time(
+            lambda: aggregate_rows(applicants, datapoints, majors), args.repeat
+        )
+        records_time = _best_time(lambda: aggregate_records(records), args.repeat)
+
+        print(
+            f"{scale:>8g} {rows_size / 2**20:>10.1f} {records_size / 2**20:>12.1f} "
+            f"{adapt_time:>9.3f} {rows_time:>9.3f} {records_time:>10.3f}"
+        )
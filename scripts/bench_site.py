@@ -0,0 +1,105 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(Path(os.path.dirname(os.path.realpath(__file__))).parent.as_posix())
+from bench_e2e import run_maker
+from seatable_stub import StubSeaTable, serve
+from synthetic_data import generate_rows
+
+
+def run_mkdocs_build(output_dir: Path) -> float | None:
+    """
+    Run `mkdocs build` in the output directory of the MkDocs frontend, and
+    return its wall time, or None if MkDocs is not installed.
+    """
+    if shutil.which("mkdocs") is None:
+        return None
+    start = time.perf_counter()
+    process = subprocess.run(
+        ["mkdocs", "build", "--quiet"],
+        cwd=output_dir,
+        stdout=subprocess.DEVNULL,
+    )
+    if process.returncode != 0:
+        raise Exception(f"mkdocs build failed with status {process.returncode}")
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the time to a servable site of the MkDocs frontend "
+        "(maker.py, then mkdocs build) and of the HTML frontend (maker.py only), "
+        "against a local SeaTable stand-in",
+        epilog="Arguments after -- are passed to maker.py, e.g. -- --jobs=4",
+    )
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--invalid-ratio", type=float, default=0.02)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="build a second time with --cached on the output of the first",
+    )
+    args, maker_args = parser.parse_known_args()
+    if maker_args[:1] == ["--"]:
+        maker_args = maker_args[1:]
+
+    stub = StubSeaTable(
+        generate_rows(args.scale, args.seed, args.invalid_ratio),
+        latency=args.latency,
+        seed=args.seed,
+    )
+    server = serve(stub)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache_dir = Path(temp_dir) / "cache"
+        # fill the cache first, so that both frontends build from the same rows
+        # and the time of fetching them is not counted
+        run_maker(
+            [
+                "--api-key=stub",
+                f"--api-base=http://127.0.0.1:{server.server_address[1]}",
+                f"--cache-dir={cache_dir}",
+                f"--output-dir={Path(temp_dir) / 'warmup'}",
+                "--frontend=html",
+            ]
+        )
+
+        # the second build reuses the output (and manifest) of the first
+        runs = ["full", "incremental"] if args.incremental else ["full"]
+        for run in runs:
+            print(f"{run} build")
+            for frontend in ["mkdocs", "html"]:
+                output_dir = Path(temp_dir) / frontend
+                output_dir.mkdir(exist_ok=True)
+                times = run_maker(
+                    [
+                        "--cached",
+                        f"--cache-dir={cache_dir}",
+                        f"--output-dir={output_dir}",
+                        f"--frontend={frontend}",
+                    ]
+                    + maker_args
+                )
+                total = times["total"]
+                print(f"  {frontend}")
+                print(f"    {'maker.py':<20}{total:>8.3f} s")
+                if frontend == "mkdocs":
+                    seconds = run_mkdocs_build(output_dir)
+                    if seconds is None:
+                        print(f"    {'mkdocs build':<20}{'skipped':>10}")
+                        total = None
+                    else:
+                        print(f"    {'mkdocs build':<20}{seconds:>8.3f} s")
+                        total += seconds
+                if total is not None:
+                    print(f"    {'time to site':<20}{total:>8.3f} s")
+
+    server.shutdown()
@@ -0,0 +1,171 @@
+import argparse
+import contextlib
+import copy
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(Path(os.path.dirname(os.path.realpath(__file__))).parent.as_posix())
+import feiyue.backend as backend
+from feiyue.frontend.html import HtmlFrontend
+from feiyue.frontend.latex import LatexFrontend
+from feiyue.frontend.mkdocs import MkDocsFrontend
+from synthetic_data import generate
+
+root_path = Path(os.path.dirname(os.path.realpath(__file__))).parent
+frontends = {"mkdocs": MkDocsFrontend, "latex": LatexFrontend, "html": HtmlFrontend}
+
+
+def _time(run, setup=lambda: None, repeat: int = 1) -> float:
+    """
+    Best wall time of `run(setup())` over `repeat` runs, with the output of both
+    silenced.
+    """
+    best = None
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            argument = setup()
+            start = time.perf_counter()
+            run(argument)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _new_frontend(name: str, output_dir: str):
+    return frontends[name](
+        Path(output_dir),
+        root_path / "templates" / name,
+        root_path / "resources" / name,
+    )
+
+
+def run_benchmarks(scale: float, args) -> dict[str, float]:
+    tables = generate(scale, args.seed, args.invalid_ratio, args.dangling_ratio)
+    timings = {}
+
+    timings["filter_out_invalid"] = _time(
+        lambda tables: backend.filter_out_invalid(*tables),
+        lambda: copy.deepcopy(tables),
+        args.repeat,
+    )
+    backend.filter_out_invalid(*tables)
+    applicants, datapoints, programs, majors = tables
+
+    timings["set_term"] = _time(
+        lambda _: backend.set_term(applicants, datapoints, key="__term"),
+        repeat=args.repeat,
+    )
+    backend.update_nickname(applicants)
+
+    for name in args.frontends:
+        with tempfile.TemporaryDirectory() as output_dir:
+            frontend = _new_frontend(name, output_dir)
+            frontend.pre_build()
+            timings[f"{name}._preprocess"] = _time(
+                lambda _: frontend._preprocess(*tables), repeat=args.repeat
+            )
+            timings[f"{name}._get_areas"] = _time(
+                lambda _: frontend._get_areas(frontend.records), repeat=args.repeat
+            )
+            for family, table in frontend.page_families:
+                build_page = getattr(frontend, f"_build_{family}_page")
+                timings[f"{name}.render {family} pages"] = _time(
+                    lambda _: [
+                        build_page(row, *tables) for row in tables[table].values()
+                    ],
+                    repeat=args.repeat,
+                )
+
+        def _build(output_dir: tempfile.TemporaryDirectory):
+            with output_dir:
+                frontend = _new_frontend(name, output_dir.name)
+                frontend.pre_build()
+                frontend.build(*tables)
+                frontend.finish()
+
+        timings[f"{name}.build"] = _time(
+            _build, tempfile.TemporaryDirectory, args.repeat
+        )
+
+    return timings
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=root_path,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time the backend and frontend hot paths on synthetic data "
+        "of growing size"
+    )
+    parser.add_argument("--scales", type=float, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--invalid-ratio", type=float, default=0.02)
+    parser.add_argument("--dangling-ratio", type=float, default=0.01)
+    parser.add_argument(
+        "--frontends", type=str, nargs="+", default=list(frontends.keys())
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="save the results to this JSON file"
+    )
+    parser.add_argument(
+        "--compare",
+        type=str,
+        default=None,
+        help="JSON file of a previous run to compare the results with",
+    )
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            baseline = {
+                result["scale"]: result["timings"] for result in json.load(f)["results"]
+            }
+
+    results = []
+    for scale in args.scales:
+        timings = run_benchmarks(scale, args)
+        results.append({"scale": scale, "timings": timings})
+
+        print(f"scale {scale:g}")
+        for name, seconds in timings.items():
+            line = f"  {name:<32}{seconds:>10.3f} s"
+            previous = baseline.get(scale, {}).get(name)
+            if previous:
+                line += f"  ({seconds / previous:.2f}x of {previous:.3f} s)"
+            print(line)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "commit": _git_commit(),
+                    "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "seed": args.seed,
+                    "invalid_ratio": args.invalid_ratio,
+                    "dangling_ratio": args.dangling_ratio,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
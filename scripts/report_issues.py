@@ -1,15 +1,121 @@
 import argparse
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import difflib
+import json
+import multiprocessing
 import os
 from pathlib import Path
+import re
 import sys
 import collections
+import unicodedata
 
 sys.path.append(Path(os.path.dirname(os.path.realpath(__file__))).parent.as_posix())
 import feiyue.backend.api as api
 import feiyue.backend as backend
+from feiyue.backend.store import RowStore
 
+# similarity of names reported as near-duplicates, as a `SequenceMatcher` ratio
+SIMILARITY = 0.85
+# n-grams shared by more names than this do not make names candidates, so that
+# common words do not put every name in the same block
+MAX_BLOCK_SIZE = 100
+# words ignored when comparing names, as most names contain them
+STOPWORDS = {"of", "the", "and", "at", "in", "for", "university", "univ", "大学"}
 
-def get_duplicate_programs(programs: dict) -> dict[tuple[str, str], list]:
+
+@dataclass
+class Check:
+    name: str
+    title: str
+    function: Callable[..., list[dict]]
+
+
+# checks run by `run_checks`, registered with `@check`
+CHECKS: dict[str, Check] = {}
+
+
+def check(name: str, title: str):
+    """
+    Register a check. A check takes the tables (`applicants`, `datapoints`,
+    `programs` and `majors`) and returns its issues, each a dict with a stable
+    `key` (to compare reports of different runs), the `ids` of the rows
+    concerned, and a human-readable `detail`.
+    """
+
+    def register(function):
+        CHECKS[name] = Check(name, title, function)
+        return function
+
+    return register
+
+
+def issue(key: str, ids: list[str], detail: str) -> dict:
+    return {"key": key, "ids": ids, "detail": detail}
+
+
+def normalize(name: str) -> str:
+    name = unicodedata.normalize("NFKC", name).lower()
+    return " ".join(re.sub(r"[\W_]+", " ", name).split())
+
+
+def _ngrams(text: str, n: int = 3) -> set[str]:
+    padded = f" {text} "
+    return {padded[i : i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+
+def find_similar(
+    names: dict[str, str], threshold: float = SIMILARITY
+) -> list[tuple[str, str, float]]:
+    """
+    Return the pairs of keys of `names` whose names are similar once
+    normalized and stripped of stopwords, with their similarity. Names
+    differing in their numbers (e.g. `Program 1` and `Program 11`) are never
+    similar.
+
+    Names are only compared with the names they share at least two trigrams
+    with (ignoring trigrams common to many names), found with an inverted
+    index, instead of with every other name.
+    """
+    normalized = {}
+    for key, name in names.items():
+        words = normalize(name or "").split()
+        text = " ".join(word for word in words if word not in STOPWORDS)
+        if text or words:
+            normalized[key] = text or " ".join(words)
+    grams = {key: _ngrams(text) for key, text in normalized.items()}
+    index = collections.defaultdict(list)
+    for key, key_grams in grams.items():
+        for gram in key_grams:
+            index[gram].append(key)
+
+    pairs = []
+    for key, key_grams in grams.items():
+        shared = collections.Counter()
+        for gram in key_grams:
+            postings = index[gram]
+            if len(postings) > MAX_BLOCK_SIZE:
+                continue
+            shared.update(other for other in postings if other > key)
+
+        for other, count in shared.items():
+            if count < min(2, len(key_grams), len(grams[other])):
+                continue
+            a, b = normalized[key], normalized[other]
+            if re.findall(r"\d+", a) != re.findall(r"\d+", b):
+                continue
+            similarity = difflib.SequenceMatcher(None, a, b).ratio()
+            if similarity >= threshold:
+                pairs.append((key, other, similarity))
+
+    return sorted(pairs)
+
+
+@check("duplicate-programs", "Duplicate programs")
+def get_duplicate_programs(applicants, datapoints, programs, majors) -> list[dict]:
     program_by_name = {}
     for program in programs.values():
         if not program.get("学校") or not program.get("项目"):
@@ -18,28 +124,100 @@ def get_duplicate_programs(programs: dict) -> dict[tuple[str, str], list]:
             (program["学校"].lower(), program["项目"].lower()), []
         ).append(program)
 
-    return {
-        name: programs
-        for name, programs in program_by_name.items()
-        if len(programs) > 1
-    }
+    return [
+        issue(
+            f"{program_name}@{school}",
+            [p["ID"] for p in duplicates],
+            f"{program_name}@{school}: {[p['ID'] for p in duplicates]}",
+        )
+        for (school, program_name), duplicates in program_by_name.items()
+        if len(duplicates) > 1
+    ]
+
+
+def _group_schools(programs: dict) -> dict[str, str]:
+    """
+    Map each school to a representative of its group of similar schools.
+    """
+    schools = {p["学校"]: p["学校"] for p in programs.values() if p.get("学校")}
+    parent = {school: school for school in schools}
 
+    def find(school: str) -> str:
+        while parent[school] != school:
+            parent[school] = parent[parent[school]]
+            school = parent[school]
+        return school
 
-def get_incomplete_programs(programs: dict) -> list[str]:
-    incomplete_programs = []
+    for a, b, _ in find_similar(schools):
+        parent[find(a)] = find(b)
+    return {school: find(school) for school in schools}
+
+
+@check("similar-schools", "Schools with similar names")
+def get_similar_schools(applicants, datapoints, programs, majors) -> list[dict]:
+    schools = {p["学校"]: p["学校"] for p in programs.values() if p.get("学校")}
+    program_ids = collections.defaultdict(list)
     for program in programs.values():
-        if not program.get("学校") or not program.get("项目"):
-            incomplete_programs.append(program["ID"])
+        program_ids[program.get("学校")].append(program["ID"])
+
+    return [
+        issue(
+            f"{a}|{b}",
+            program_ids[a] + program_ids[b],
+            f"{a} ~ {b} ({similarity:.2f}): "
+            f"{len(program_ids[a])} and {len(program_ids[b])} programs",
+        )
+        for a, b, similarity in find_similar(schools)
+    ]
+
+
+@check("similar-programs", "Programs with similar names")
+def get_similar_programs(applicants, datapoints, programs, majors) -> list[dict]:
+    # only programs of the same school, or of schools with similar names
+    school_groups = _group_schools(programs)
+    programs_by_group = collections.defaultdict(dict)
+    for program in programs.values():
+        if program.get("学校") and program.get("项目"):
+            programs_by_group[school_groups[program["学校"]]][program["ID"]] = program
+
+    issues = []
+    for group in programs_by_group.values():
+        names = {id: program["项目"] for id, program in group.items()}
+        for a, b, similarity in find_similar(names):
+            program_a, program_b = group[a], group[b]
+            if (program_a["学校"].lower(), program_a["项目"].lower()) == (
+                program_b["学校"].lower(),
+                program_b["项目"].lower(),
+            ):
+                # reported as duplicates
+                continue
+            issues.append(
+                issue(
+                    f"{a}|{b}",
+                    [a, b],
+                    f"{program_a['项目']}@{program_a['学校']} ~ "
+                    f"{program_b['项目']}@{program_b['学校']} ({similarity:.2f}): "
+                    f"{[a, b]}",
+                )
+            )
+    return issues
+
 
-    return incomplete_programs
+@check("incomplete-programs", "Incomplete programs")
+def get_incomplete_programs(applicants, datapoints, programs, majors) -> list[dict]:
+    return [
+        issue(program["ID"], [program["ID"]], program["ID"])
+        for program in programs.values()
+        if not program.get("学校") or not program.get("项目")
+    ]
 
 
+@check("duplicate-datapoints", "Duplicate datapoints")
 def get_duplicate_datapoints_of_applicants(
-    applicants: dict, datapoints: dict, programs: dict
-) -> dict[str, list]:
-    ret = {}
+    applicants, datapoints, programs, majors
+) -> list[dict]:
+    ret = []
     for applicant in applicants.values():
-        duplicate_programs = []
         if not applicant.get("数据点", []):
             continue
         duplicate_programs = [
@@ -48,30 +226,117 @@ def get_duplicate_datapoints_of_applicants(
                 [
                     programs[datapoints[dp]["项目"][0]["row_id"]]["ID"]
                     for dp in applicant["数据点"]
-                    if datapoints[dp]["项目"]
+                    if dp in datapoints
+                    and datapoints[dp].get("项目")
+                    and datapoints[dp]["项目"][0]["row_id"] in programs
                 ]
             ).items()
             if count > 1
         ]
         if duplicate_programs:
-            ret[applicant["ID"]] = duplicate_programs
+            ret.append(
+                issue(
+                    applicant["ID"],
+                    [applicant["ID"]] + duplicate_programs,
+                    f"{applicant['ID']}: {duplicate_programs}",
+                )
+            )
 
     return ret
 
 
-def get_uncategorized_areas(applicants: dict) -> list[str]:
+@check("uncategorized-areas", "Applicants with uncategorized application areas")
+def get_uncategorized_areas(applicants, datapoints, programs, majors) -> list[dict]:
     return [
-        applicant["ID"]
+        issue(applicant["ID"], [applicant["ID"]], applicant["ID"])
         for applicant in applicants.values()
         if "未分类" in (applicant.get("申请方向") or [])
     ]
 
 
+@check("dropped-rows", "Rows not shown on the site")
+def get_dropped_rows(applicants, datapoints, programs, majors) -> list[dict]:
+    # the same filter as the build, on copies since it drops rows and replaces
+    # their links in place
+    tables = [
+        {id: dict(row) for id, row in table.items()}
+        for table in (applicants, datapoints, programs, majors)
+    ]
+    return [
+        issue(
+            f"{row['table']}:{row['ID']}",
+            [row["ID"]],
+            f"{row['table']} {row['ID']}: {row['reason']}",
+        )
+        for row in backend.filter_out_invalid(*tables)
+    ]
+
+
+_worker_tables: tuple = None
+
+
+def _init_worker(tables: tuple):
+    global _worker_tables
+    _worker_tables = tables
+
+
+def _run_check(name: str) -> list[dict]:
+    return CHECKS[name].function(*_worker_tables)
+
+
+def run_checks(tables: tuple, names: list[str], jobs: int = 1) -> dict[str, list]:
+    """
+    Run the checks `names` on `tables`, in `jobs` processes if more than one.
+    Workers are forked, so they share the tables with this process.
+    """
+    if jobs > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        print("Checking in parallel needs fork(), checking serially", file=sys.stderr)
+        jobs = 1
+
+    if jobs <= 1:
+        return {name: CHECKS[name].function(*tables) for name in names}
+
+    with ProcessPoolExecutor(
+        jobs,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_worker,
+        initargs=(tables,),
+    ) as executor:
+        futures = {name: executor.submit(_run_check, name) for name in names}
+        return {name: future.result() for name, future in futures.items()}
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--api-key", type=str, default=None)
-    parser.add_argument("--api-base", type=str, default="https://cloud.seatable.io")
+    parser.add_argument("--api-base", type=str, default=api.DEFAULT_API_BASE)
     parser.add_argument("--output", type=str, default="output/issues.log")
+    parser.add_argument(
+        "--store",
+        type=str,
+        default=None,
+        help="read rows from this row store (e.g. .cache/rows.sqlite3) instead of the API",
+    )
+    parser.add_argument(
+        "--checks",
+        type=str,
+        nargs="+",
+        default=list(CHECKS.keys()),
+        choices=list(CHECKS.keys()),
+    )
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--json",
+        type=str,
+        default=None,
+        help="write the issues found to this JSON file",
+    )
+    parser.add_argument(
+        "--previous",
+        type=str,
+        default=None,
+        help="JSON report of a previous run; only issues not in it are logged",
+    )
     args = parser.parse_args()
 
     Path(args.output).parent.mkdir(parents=True, exist_ok=True)
@@ -81,51 +346,56 @@ if __name__ == "__main__":
             print(*_args, **_kwargs, file=f)
         print(*_args, **_kwargs, file=sys.stderr)
 
-    api.api_base = args.api_base
-    api.init_base_token(args.api_key)
-
-    all_applicants, all_datapoints, all_programs, all_majors = backend.get_all_rows(
-        args.api_key
-    )
-
-    duplicate_programs = get_duplicate_programs(all_programs)
-
-    if len(duplicate_programs) == 0:
-        print("No duplicate programs found.", file=sys.stderr)
+    if args.store is not None:
+        store = RowStore(Path(args.store))
+        rows = store.load()
+        store.close()
+        tables = (rows["申请人"], rows["数据点"], rows["项目"], rows["本科专业"])
     else:
-        log("**Duplicate programs**\n")
-        for (school, program_name), programs in duplicate_programs.items():
-            log(f" - {program_name}@{school}: {[p['ID'] for p in programs]}")
-        log("")
-
-    incomplete_programs = get_incomplete_programs(all_programs)
+        client = api.SeaTableClient(args.api_key, args.api_base)
+        tables = backend.get_all_rows(client)
 
-    if len(incomplete_programs) == 0:
-        print("No incomplete programs found.", file=sys.stderr)
-    else:
-        log("**Incomplete programs**\n")
-        for program_id in incomplete_programs:
-            log(f" - {program_id}")
-        log("")
+    results = run_checks(tables, args.checks, args.jobs)
 
-    duplicate_datapoints = get_duplicate_datapoints_of_applicants(
-        all_applicants, all_datapoints, all_programs
-    )
+    previous = {}
+    if args.previous is not None:
+        try:
+            with open(args.previous, "r") as f:
+                previous = {
+                    name: {found["key"] for found in result["issues"]}
+                    for name, result in json.load(f)["checks"].items()
+                }
+        except (OSError, ValueError, KeyError):
+            print(f"No previous report read from {args.previous}", file=sys.stderr)
 
-    if len(duplicate_datapoints) == 0:
-        print("No duplicate datapoints found.", file=sys.stderr)
-    else:
-        log("**Duplicate datapoints**\n")
-        for applicant_id, programs in duplicate_datapoints.items():
-            log(f" - {applicant_id}: {programs}")
-        log("")
+    for name, issues in results.items():
+        title = CHECKS[name].title
+        if name in previous:
+            keys = {found["key"] for found in issues}
+            resolved = len(previous[name] - keys)
+            issues = [found for found in issues if found["key"] not in previous[name]]
+            print(f"{title}: {len(issues)} new, {resolved} resolved", file=sys.stderr)
+        elif len(issues) == 0:
+            print(f"{title}: none found", file=sys.stderr)
 
-    uncategorized_areas = get_uncategorized_areas(all_applicants)
+        if len(issues) > 0:
+            log(f"**{title}**\n")
+            for found in issues:
+                log(f" - {found['detail']}")
+            log("")
 
-    if len(uncategorized_areas) == 0:
-        print("No uncategorized areas found.", file=sys.stderr)
-    else:
-        log("**Applicants with uncategorized application areas**\n")
-        for applicant_id in uncategorized_areas:
-            log(f" - {applicant_id}")
-        log("")
+    if args.json is not None:
+        Path(args.json).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                    "checks": {
+                        name: {"title": CHECKS[name].title, "issues": issues}
+                        for name, issues in results.items()
+                    },
+                },
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
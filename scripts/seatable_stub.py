@@ -0,0 +1,242 @@
+import argparse
+import collections
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+sys.path.append(Path(os.path.dirname(os.path.realpath(__file__))).parent.as_posix())
+from synthetic_data import generate_rows
+
+DTABLE_UUID = "00000000-0000-0000-0000-000000000000"
+
+_rows_path = re.compile(r"^/api-gateway/api/v2/dtables/[^/]+/rows/?$")
+_sql_path = re.compile(r"^/api-gateway/api/v2/dtables/[^/]+/sql/?$")
+# the queries sent by `backend.sync_all_rows`, through `SeaTableClient.query`
+_sql_query = re.compile(
+    r"^SELECT (?P<columns>\*|`_id`) FROM `(?P<table>[^`]+)`"
+    r"(?: WHERE `_mtime` >= '(?P<since>(?:[^']|'')*)')?"
+    r"(?P<order> ORDER BY `_id`)?"
+    r" LIMIT (?P<limit>\d+) OFFSET (?P<offset>\d+)$"
+)
+
+
+class StubSeaTable:
+    """
+    Stand-in for the endpoints of SeaTable used by `feiyue.backend.api`, serving
+    synthetic tables.
+
+    Every request waits `latency` seconds. Requests beyond `rate_limit` per
+    second are answered with 429 and a `Retry-After` header, and a fraction
+    `failure_rate` of the other requests fails with 500.
+    """
+
+    def __init__(
+        self,
+        rows_by_table: dict[str, dict],
+        latency: float = 0,
+        rate_limit: float = None,
+        failure_rate: float = 0,
+        image_size: int = 64 * 1024,
+        seed: int = 0,
+    ):
+        self.tables = {
+            table: list(rows.values()) for table, rows in rows_by_table.items()
+        }
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.failure_rate = failure_rate
+        self.image_size = image_size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts: collections.Counter = collections.Counter()
+        self.allowance = rate_limit
+        self.last_request = time.monotonic()
+
+    def admit(self, endpoint: str) -> int:
+        """
+        Count a request to `endpoint`, and return the status of an injected
+        error, or 200.
+        """
+        time.sleep(self.latency)
+        with self.lock:
+            self.counts[endpoint] += 1
+            if self.rate_limit is not None:
+                # token bucket refilled at `rate_limit` requests per second
+                now = time.monotonic()
+                self.allowance = min(
+                    self.rate_limit,
+                    self.allowance + (now - self.last_request) * self.rate_limit,
+                )
+                self.last_request = now
+                if self.allowance < 1:
+                    self.counts["429"] += 1
+                    return 429
+                self.allowance -= 1
+            if self.random.random() < self.failure_rate:
+                self.counts["500"] += 1
+                return 500
+        return 200
+
+    def get_rows(self, table: str, start: int, limit: int) -> list:
+        return self.tables[table][start : start + limit]
+
+    def query(self, sql: str) -> list:
+        match = _sql_query.match(sql)
+        if match is None:
+            raise Exception(f"Unsupported query {sql}")
+        rows = self.tables[match["table"]]
+        if match["since"] is not None:
+            since = match["since"].replace("''", "'")
+            rows = [row for row in rows if row.get("_mtime", "") >= since]
+        if match["order"] is not None:
+            rows = sorted(rows, key=lambda row: row["_id"])
+        else:
+            # unspecified, and not stable between the pages of a query
+            rows = list(rows)
+            with self.lock:
+                self.random.shuffle(rows)
+        if match["columns"] != "*":
+            rows = [{"_id": row["_id"]} for row in rows]
+        offset = int(match["offset"])
+        return rows[offset : offset + int(match["limit"])]
+
+    def get_image(self, path: str) -> bytes:
+        # deterministic content, so that the image cache can be checked
+        seed = hashlib.sha256(path.encode()).digest()
+        return (seed * (self.image_size // len(seed) + 1))[: self.image_size]
+
+
+def make_handler(stub: StubSeaTable):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body: bytes, content_type: str):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            if status == 429:
+                self.send_header("Retry-After", "1")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, data):
+            self._send(
+                200, json.dumps(data, ensure_ascii=False).encode(), "application/json"
+            )
+
+        def _route(self, method: str):
+            url = urlparse(self.path)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+            if method == "GET" and url.path.rstrip("/") == "/stats":
+                with stub.lock:
+                    return self._send_json(dict(stub.counts))
+
+            if method == "GET" and url.path == "/api/v2.1/dtable/app-access-token/":
+                endpoint = "app-access-token"
+            elif method == "GET" and _rows_path.match(url.path):
+                endpoint = "rows"
+            elif method == "POST" and _sql_path.match(url.path):
+                endpoint = "sql"
+            elif method == "GET" and url.path == "/api/v2.1/dtable/app-download-link":
+                endpoint = "app-download-link"
+            elif method == "GET" and url.path.startswith("/assets/"):
+                endpoint = "image"
+            else:
+                return self._send(404, b"Not found", "text/plain")
+
+            body = None
+            if method == "POST":
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+
+            status = stub.admit(endpoint)
+            if status != 200:
+                return self._send(status, b"Injected error", "text/plain")
+
+            if endpoint == "app-access-token":
+                self._send_json(
+                    {"access_token": "stub-token", "dtable_uuid": DTABLE_UUID}
+                )
+            elif endpoint == "rows":
+                rows = stub.get_rows(
+                    query["table_name"],
+                    int(query.get("start", 0)),
+                    int(query.get("limit", 1000)),
+                )
+                self._send_json({"rows": rows})
+            elif endpoint == "sql":
+                self._send_json({"results": stub.query(body["sql"])})
+            elif endpoint == "app-download-link":
+                host = self.headers["Host"]
+                self._send_json(
+                    {"download_link": f"http://{host}/assets{query['path']}"}
+                )
+            else:
+                self._send(200, stub.get_image(url.path), "image/png")
+
+        def do_GET(self):
+            self._route("GET")
+
+        def do_POST(self):
+            self._route("POST")
+
+    return Handler
+
+
+def serve(stub: StubSeaTable, port: int = 0) -> ThreadingHTTPServer:
+    """
+    Serve `stub` on localhost in a background thread. The port is chosen by the
+    system if `port` is 0; it is `server.server_address[1]`.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(stub))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve synthetic tables through the SeaTable endpoints used by the backend"
+    )
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--invalid-ratio", type=float, default=0)
+    parser.add_argument("--latency", type=float, default=0, help="seconds per request")
+    parser.add_argument(
+        "--rate-limit", type=float, default=None, help="requests per second before 429"
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0,
+        help="fraction of requests failing with 500",
+    )
+    parser.add_argument("--image-size", type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    stub = StubSeaTable(
+        generate_rows(args.scale, args.seed, args.invalid_ratio),
+        latency=args.latency,
+        rate_limit=args.rate_limit,
+        failure_rate=args.failure_rate,
+        image_size=args.image_size,
+        seed=args.seed,
+    )
+    server = serve(stub, args.port)
+    print(f"Serving on http://127.0.0.1:{server.server_address[1]}, stats at /stats")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,271 @@
+import argparse
+import datetime
+import os
+import random
+import string
+import sys
+from pathlib import Path
+
+sys.path.append(Path(os.path.dirname(os.path.realpath(__file__))).parent.as_posix())
+import feiyue.backend as backend
+from feiyue.backend.store import RowStore
+
+# roughly the size of the database at the time of writing, i.e. scale 1
+BASE_SIZES = {
+    "本科专业": 80,
+    "申请人": 400,
+    "项目": 1200,
+    "数据点": 4000,
+}
+
+DEPARTMENTS = [
+    "计算机系",
+    "电子系",
+    "自动化系",
+    "物理系",
+    "数学系",
+    "化学系",
+    "生命学院",
+    "经管学院",
+    "机械系",
+    "航院",
+    "材料学院",
+    "环境学院",
+    "建筑学院",
+    "工物系",
+    "化工系",
+    "交叉信息研究院",
+    "本科外校",
+]
+SCHOOLS = [
+    "MIT",
+    "Stanford",
+    "UC Berkeley",
+    "CMU",
+    "Princeton",
+    "Harvard",
+    "Caltech",
+    "Cornell",
+    "UIUC",
+    "UW",
+    "Columbia",
+    "Yale",
+    "UPenn",
+    "ETH Zurich",
+    "EPFL",
+    "Oxford",
+    "Cambridge",
+    "Imperial College London",
+    "Toronto",
+    "NUS",
+]
+PROGRAM_CATEGORIES = ["PhD", "Master", "MPhil", "RA"]
+AREAS = [
+    "Machine Learning",
+    "Computer Vision",
+    "NLP",
+    "Systems",
+    "Theory",
+    "Robotics",
+    "Security",
+    "HCI",
+    "Networking",
+    "Architecture",
+    "Quantum",
+    "Condensed Matter",
+    "Astrophysics",
+    "Biology",
+    "Chemistry",
+    "Finance",
+    "Economics",
+    "Materials",
+    "Control",
+    "Signal Processing",
+    "Optics",
+    "Energy",
+    "未分类",
+]
+TERMS = ["Spring", "Fall"]
+RESULTS = ["Admit", "Reject", "Withdraw", None]
+
+
+def _row_id(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_letters + string.digits, k=22))
+
+
+def _link(row: dict) -> list:
+    return [{"row_id": row["_id"], "display_value": row["ID"]}]
+
+
+def _timestamp(rng: random.Random) -> str:
+    t = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    t += datetime.timedelta(seconds=rng.randrange(4 * 365 * 24 * 3600))
+    return t.isoformat(timespec="milliseconds")
+
+
+def _paragraphs(rng: random.Random, count: int) -> str:
+    words = ["申请", "项目", "科研", "推荐信", "面试", "GPA", "套磁", "offer", "选校"]
+    return "\n\n".join(
+        " ".join(rng.choices(words, k=rng.randrange(20, 80))) for _ in range(count)
+    )
+
+
+def generate_rows(
+    scale: float = 1, seed: int = 0, invalid_ratio: float = 0, dangling_ratio: float = 0
+) -> dict[str, dict]:
+    """
+    Generate referentially consistent tables shaped like the SeaTable API rows
+    (`convert_keys` on), keyed by table name and then by row id.
+
+    About `invalid_ratio` of the rows are made invalid: rows lacking required
+    columns, applicants without a final destination, and links to rows that do
+    not exist. About `dangling_ratio` of the applicants, datapoints and majors
+    additionally link to an applicant or major that does not exist.
+    """
+    rng = random.Random(seed)
+    sizes = {table: max(int(size * scale), 1) for table, size in BASE_SIZES.items()}
+
+    def _new_row(prefix: str, index: int) -> dict:
+        ctime = _timestamp(rng)
+        return {
+            "_id": _row_id(rng),
+            "_ctime": ctime,
+            "_mtime": max(ctime, _timestamp(rng)),
+            "ID": f"{prefix}-{index + 1:05d}",
+        }
+
+    majors = {}
+    for i in range(sizes["本科专业"]):
+        major = _new_row("M", i)
+        major["院系"] = DEPARTMENTS[i % len(DEPARTMENTS)]
+        major["专业"] = f"专业{i + 1}"
+        major["申请人"] = []
+        majors[major["_id"]] = major
+
+    programs = {}
+    for i in range(sizes["项目"]):
+        program = _new_row("P", i)
+        program["学校"] = rng.choice(SCHOOLS)
+        program["项目"] = f"Program {i + 1}"
+        program["类别"] = rng.choice(PROGRAM_CATEGORIES)
+        programs[program["_id"]] = program
+
+    applicants = {}
+    applicant_terms = {}
+    major_list = list(majors.values())
+    for i in range(sizes["申请人"]):
+        applicant = _new_row("A", i)
+        major = rng.choice(major_list)
+        applicant["专业"] = _link(major)
+        major["申请人"] += _link(applicant)
+        if rng.random() < 0.7:
+            applicant["姓名/昵称"] = f"昵称{i + 1}"
+        applicant["GPA"] = round(rng.uniform(3.0, 4.0), 2)
+        applicant["排名"] = f"{rng.randrange(1, 30)}/{rng.randrange(30, 200)}"
+        applicant["TOEFL/IELTS 总分"] = rng.randrange(95, 120)
+        applicant["GRE 总分 (V+Q)"] = rng.randrange(315, 341)
+        applicant["申请方向"] = (
+            rng.sample(AREAS, rng.randrange(1, 4)) if rng.random() < 0.9 else []
+        )
+        applicant["申请总结"] = _paragraphs(rng, rng.randrange(1, 8))
+        if rng.random() < 0.1:
+            image = f"{_row_id(rng)}.png"
+            applicant["申请总结"] += (
+                f"\n\n![](https://cloud.seatable.io/workspace/1/asset/"
+                f"{_row_id(rng)}/images/auto-upload/{image})"
+            )
+        applicants[applicant["_id"]] = applicant
+        applicant_terms[applicant["_id"]] = (
+            rng.randrange(2018, 2026),
+            rng.choice(TERMS),
+        )
+
+    datapoints = {}
+    applicant_list = list(applicants.values())
+    program_list = list(programs.values())
+    for i in range(sizes["数据点"]):
+        datapoint = _new_row("D", i)
+        applicant = applicant_list[i % len(applicant_list)]
+        datapoint["申请人"] = _link(applicant)
+        datapoint["项目"] = _link(rng.choice(program_list))
+        year, term = applicant_terms[applicant["_id"]]
+        if rng.random() < 0.1:
+            year -= 1
+        datapoint["学年"] = year
+        datapoint["学期"] = term
+        datapoint["结果"] = rng.choice(RESULTS)
+        datapoint["最终去向"] = False
+        datapoints[datapoint["_id"]] = datapoint
+
+    # every applicant chooses one of their admits, if any
+    chosen = set()
+    for datapoint in datapoints.values():
+        applicant_id = datapoint["申请人"][0]["row_id"]
+        if datapoint["结果"] == "Admit" and applicant_id not in chosen:
+            datapoint["最终去向"] = True
+            chosen.add(applicant_id)
+
+    # break some rows in the ways seen in the real database
+    for table, rows, link_column in [
+        ("本科专业", majors, "申请人"),
+        ("申请人", applicants, "专业"),
+        ("项目", programs, "学校"),
+        ("数据点", datapoints, "项目"),
+    ]:
+        for row in rng.sample(list(rows.values()), int(len(rows) * invalid_ratio)):
+            if rng.random() < 0.5:
+                row.pop(link_column, None)
+            elif isinstance(row.get(link_column), list):
+                row[link_column] = [{"row_id": _row_id(rng), "display_value": ""}]
+            else:
+                row[link_column] = ""
+
+    # links to rows deleted from the database
+    for rows, link_column, multiple in [
+        (applicants, "专业", False),
+        (datapoints, "申请人", False),
+        (majors, "申请人", True),
+    ]:
+        for row in rng.sample(list(rows.values()), int(len(rows) * dangling_ratio)):
+            dangling = [{"row_id": _row_id(rng), "display_value": ""}]
+            if multiple:
+                dangling = row.get(link_column, []) + dangling
+            row[link_column] = dangling
+
+    return {
+        "本科专业": majors,
+        "申请人": applicants,
+        "项目": programs,
+        "数据点": datapoints,
+    }
+
+
+def generate(
+    scale: float = 1, seed: int = 0, invalid_ratio: float = 0, dangling_ratio: float = 0
+) -> tuple[dict, dict, dict, dict]:
+    """
+    Generate tables as returned by `backend.get_all_rows`.
+    """
+    rows = generate_rows(scale, seed, invalid_ratio, dangling_ratio)
+    backend._rebuild_relations(rows["申请人"], rows["数据点"], rows["项目"])
+    return rows["申请人"], rows["数据点"], rows["项目"], rows["本科专业"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic database into the row store"
+    )
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--invalid-ratio", type=float, default=0)
+    parser.add_argument("--dangling-ratio", type=float, default=0)
+    parser.add_argument("--output-dir", type=str, default=".cache")
+    args = parser.parse_args()
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tables = generate(args.scale, args.seed, args.invalid_ratio, args.dangling_ratio)
+    rows = dict(zip(["申请人", "数据点", "项目", "本科专业"], tables))
+    store = RowStore(output_dir / "rows.sqlite3")
+    store.save(rows, backend.get_watermarks(rows))
+    store.close()
@@ -0,0 +1,242 @@
+import copy
+import json
+import os
+import sys
+import zipfile
+from pathlib import Path
+
+import pytest
+
+root_path = Path(os.path.dirname(os.path.realpath(__file__))).parent
+sys.path.append(root_path.as_posix())
+from feiyue.backend.dtable import DtableArchive
+
+USER = "2f8b6e9c1a4d4f0e8c7b5a3d2e1f0a9b@auth.local"
+
+
+def _column(key: str, type: str, name: str, data: dict = None) -> dict:
+    # as in a SeaTable export, with the attributes of the table view
+    return {
+        "key": key,
+        "type": type,
+        "name": name,
+        "editable": type not in ("formula", "link-formula", "auto-number"),
+        "width": 200,
+        "resizable": True,
+        "draggable": True,
+        "data": data,
+        "permission_type": "",
+        "permitted_users": [],
+    }
+
+
+def _row(id: str, cells: dict) -> dict:
+    return {
+        "_id": id,
+        "_participants": [],
+        "_creator": USER,
+        "_ctime": "2023-09-01T08:00:00.000+00:00",
+        "_last_modifier": USER,
+        "_mtime": "2024-01-02T08:00:00.000+00:00",
+        **cells,
+    }
+
+
+def _link_column(key: str, name: str, table_id: str, other_table_id: str) -> dict:
+    return _column(
+        key,
+        "link",
+        name,
+        {
+            "display_column_key": "0000",
+            "table_id": table_id,
+            "other_table_id": other_table_id,
+            "is_internal_link": True,
+            "link_id": "Lk01" if "1111" in (table_id, other_table_id) else "Lk02",
+        },
+    )
+
+
+def _table(id: str, name: str, columns: list, rows: list) -> dict:
+    return {
+        "_id": id,
+        "name": name,
+        "is_header_locked": False,
+        "header_settings": {},
+        "summary_configs": {},
+        "columns": columns,
+        "rows": rows,
+        "views": [
+            {
+                "_id": "0000",
+                "name": "默认视图",
+                "type": "table",
+                "filters": [],
+                "sorts": [],
+                "groupbys": [],
+                "hidden_columns": [],
+                "rows": [],
+                "formula_rows": {},
+            }
+        ],
+        "id_row_map": {},
+    }
+
+
+# a base shaped like `content.json` of a real export: formula, auto-number and
+# metadata columns, select options and link maps keyed by ids
+CONTENT = {
+    "version": 20412,
+    "format_version": 8,
+    "statistics": [],
+    "links": [
+        {
+            "_id": "Lk01",
+            "table1_id": "3333",
+            "table2_id": "1111",
+            "table1_table2_map": {"dp1": ["ap1"]},
+            "table2_table1_map": {"ap1": ["dp1"]},
+        },
+        {
+            "_id": "Lk02",
+            "table1_id": "3333",
+            "table2_id": "2222",
+            "table1_table2_map": {"dp1": ["pr1"]},
+            "table2_table1_map": {"pr1": ["dp1"]},
+        },
+    ],
+    "tables": [
+        _table(
+            "0000",
+            "本科专业",
+            [
+                _column("0000", "text", "ID"),
+                _column("kDep", "text", "院系"),
+            ],
+            [_row("mj1", {"0000": "M-00001", "kDep": "计算机系"})],
+        ),
+        _table(
+            "1111",
+            "申请人",
+            [
+                _column(
+                    "0000",
+                    "auto-number",
+                    "ID",
+                    {
+                        "format": "A-00000",
+                        "max_used_auto_number": 1,
+                        "digits": 5,
+                        "prefix_type": "string",
+                        "prefix": "A-",
+                    },
+                ),
+                _column(
+                    "kGpa", "number", "GPA", {"format": "number", "decimal": "dot"}
+                ),
+                _column("kMod", "mtime", "修改时间"),
+                _column("kBy", "creator", "创建者"),
+                _column("kBtn", "button", "审核", {"button_type": "open_url"}),
+                _link_column("kDp", "数据点", "1111", "3333"),
+            ],
+            [_row("ap1", {"0000": "A-00001", "kGpa": 3.9})],
+        ),
+        _table(
+            "2222",
+            "项目",
+            [
+                _column("0000", "text", "ID"),
+                _column("kSch", "text", "学校"),
+                _column(
+                    "kCat",
+                    "single-select",
+                    "类别",
+                    {
+                        "options": [
+                            {
+                                "name": "CS",
+                                "id": "834301",
+                                "color": "#46A1FD",
+                                "textColor": "#FFFFFF",
+                            }
+                        ]
+                    },
+                ),
+                _column(
+                    "kNam",
+                    "formula",
+                    "名称",
+                    {
+                        "formula": "{学校} & ' ' & {ID}",
+                        "result_type": "string",
+                        "operated_columns": ["kSch", "0000"],
+                    },
+                ),
+            ],
+            [
+                _row(
+                    "pr1",
+                    {
+                        "0000": "P-00001",
+                        "kSch": "MIT",
+                        "kCat": "834301",
+                        "kNam": "MIT P-00001",
+                    },
+                )
+            ],
+        ),
+        _table(
+            "3333",
+            "数据点",
+            [
+                _column("0000", "text", "ID"),
+                _link_column("kAp", "申请人", "3333", "1111"),
+                _link_column("kPr", "项目", "3333", "2222"),
+            ],
+            [_row("dp1", {"0000": "D-00001"})],
+        ),
+    ],
+    "collaborators": [],
+    "settings": {"securities": {}},
+    "plugin_settings": {},
+}
+
+
+def _archive(path: Path, content: dict) -> Path:
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("content.json", json.dumps(content, ensure_ascii=False))
+    return path
+
+
+def test_rows_converted_like_api_rows(tmp_path):
+    archive = DtableArchive(_archive(tmp_path / "base.dtable", CONTENT))
+    applicants, datapoints, programs, majors = archive.get_all_rows()
+    archive.close()
+
+    applicant = applicants["ap1"]
+    assert applicant["ID"] == "A-00001"
+    assert applicant["修改时间"] == "2024-01-02T08:00:00.000+00:00"
+    assert applicant["创建者"] == USER
+    assert "审核" not in applicant
+    assert applicant["数据点"] == ["dp1"]
+
+    program = programs["pr1"]
+    assert program["类别"] == "CS"
+    assert program["名称"] == "MIT P-00001"
+
+    datapoint = datapoints["dp1"]
+    assert datapoint["申请人"] == [{"row_id": "ap1", "display_value": "A-00001"}]
+    assert datapoint["项目"] == [{"row_id": "pr1", "display_value": "P-00001"}]
+    assert majors["mj1"]["院系"] == "计算机系"
+
+
+def test_computed_columns_without_values_rejected(tmp_path):
+    content = copy.deepcopy(CONTENT)
+    # formula results and auto numbers are not kept by every export
+    for table in content["tables"]:
+        for row in table["rows"]:
+            row.pop("kNam", None)
+    archive = DtableArchive(_archive(tmp_path / "base.dtable", content))
+    with pytest.raises(Exception, match="名称 of table 项目 is a formula column"):
+        archive.get_all_rows()
+    archive.close()
@@ -0,0 +1,72 @@
+import filecmp
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+root_path = Path(os.path.dirname(os.path.realpath(__file__))).parent
+sys.path.append(root_path.as_posix())
+sys.path.append((root_path / "scripts").as_posix())
+import feiyue.backend as backend
+from feiyue.backend.store import RowStore
+from synthetic_data import generate
+
+
+def _save_rows(cache_dir: Path, rows: dict):
+    store = RowStore(cache_dir / "rows.sqlite3")
+    store.save(rows, backend.get_watermarks(rows))
+    store.close()
+
+
+def _build(cache_dir: Path, output_dir: Path, frontend: str):
+    subprocess.run(
+        [
+            sys.executable,
+            root_path / "maker.py",
+            "--cached",
+            f"--cache-dir={cache_dir}",
+            f"--output-dir={output_dir}",
+            f"--frontend={frontend}",
+        ],
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+
+
+def _tree(output_dir: Path) -> set[str]:
+    paths = set()
+    for dir_path, dir_names, file_names in os.walk(output_dir):
+        for name in dir_names + file_names:
+            path = Path(dir_path) / name
+            if not name.endswith("-manifest.json"):
+                paths.add(path.relative_to(output_dir).as_posix())
+    return paths
+
+
+def test_incremental_html_build_matches_fresh_build(tmp_path):
+    rows = dict(zip(["申请人", "数据点", "项目", "本科专业"], generate(0.1, seed=1)))
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    _save_rows(cache_dir, rows)
+    incremental_dir = tmp_path / "incremental"
+    _build(cache_dir, incremental_dir, "html")
+
+    # remove some applicants and programs, whose pages are then stale
+    for table in ["申请人", "项目"]:
+        for id in list(rows[table])[:3]:
+            del rows[table][id]
+    _save_rows(cache_dir, rows)
+    _build(cache_dir, incremental_dir, "html")
+    fresh_dir = tmp_path / "fresh"
+    _build(cache_dir, fresh_dir, "html")
+
+    tree = _tree(fresh_dir)
+    assert _tree(incremental_dir) == tree
+    # except the home page, which has the build time
+    files = [
+        path for path in tree if (fresh_dir / path).is_file() and path != "index.html"
+    ]
+    _, mismatch, errors = filecmp.cmpfiles(
+        fresh_dir, incremental_dir, files, shallow=False
+    )
+    assert mismatch == [] and errors == []
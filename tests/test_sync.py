@@ -0,0 +1,49 @@
+import copy
+import functools
+import os
+import sys
+from pathlib import Path
+
+root_path = Path(os.path.dirname(os.path.realpath(__file__))).parent
+sys.path.append(root_path.as_posix())
+sys.path.append((root_path / "scripts").as_posix())
+import feiyue.backend as backend
+from feiyue.backend import api
+from seatable_stub import StubSeaTable, serve
+from synthetic_data import generate_rows
+
+
+def test_sync_matches_full_fetch():
+    stub = StubSeaTable(generate_rows(0.05, seed=2))
+    server = serve(stub)
+    client = api.SeaTableClient(
+        "stub", api_base=f"http://127.0.0.1:{server.server_address[1]}"
+    )
+    # pages smaller than the tables, so that the order of the rows matters
+    client.query = functools.partial(client.query, page_size=7)
+    try:
+        cached = backend.get_all_rows(client)
+        cached_rows = dict(zip(["申请人", "数据点", "项目", "本科专业"], cached))
+        watermarks = backend.get_watermarks(cached_rows)
+
+        # a deleted row, a modified row and a new row in every table
+        for rows in stub.tables.values():
+            del rows[1]
+            rows[2] = dict(rows[2], _mtime="2100-01-01T00:00:00.000+00:00")
+            new_row = copy.deepcopy(rows[0])
+            new_row.update(_id="new" + rows[0]["_id"], _mtime="2100-01-01T00:00:00")
+            rows.append(new_row)
+
+        synced, _, counts = backend.sync_all_rows(
+            client, copy.deepcopy(cached_rows), watermarks
+        )
+        fetched = dict(
+            zip(["申请人", "数据点", "项目", "本科专业"], backend.get_all_rows(client))
+        )
+    finally:
+        server.shutdown()
+
+    for table, rows in fetched.items():
+        assert list(synced[table]) == list(rows)
+        assert synced[table] == rows
+        assert counts[table][1] == 1